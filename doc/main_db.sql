@@ -4,80 +4,126 @@ BEGIN TRANSACTION;
 
 CREATE TABLE IF NOT EXISTS users(
 	id_user INTEGER PRIMARY KEY,
-	username TEXT UNIQUE,
-	encoding BLOB
+	username BLOB UNIQUE,
+	encoding BLOB,
+	wrapped_key BLOB,
+	kdf TEXT
 );
 
 CREATE TABLE IF NOT EXISTS logs(
 	id_log INTEGER PRIMARY KEY,
-	event_timestamp TEXT,
+	event_timestamp BLOB,
 	event_user INTEGER,
-	event_detail TEXT,
+	event_detail BLOB,
+	record BLOB,
 	FOREIGN KEY(event_user) REFERENCES users(id_user)
 );
 
 CREATE TABLE IF NOT EXISTS notes(
 	id_note INTEGER PRIMARY KEY,
-	title TEXT,
-	content TEXT,
-	note_timestamp TEXT,
+	title BLOB,
+	content BLOB,
+	note_timestamp BLOB,
 	id_user INTEGER,
+	record BLOB,
 	FOREIGN KEY(id_user) REFERENCES users(id_user)
 );
 
+CREATE TABLE IF NOT EXISTS note_chunk(
+	id_chunk INTEGER PRIMARY KEY,
+	id_note INTEGER,
+	seq INTEGER,
+	digest BLOB,
+	record BLOB,
+	UNIQUE(id_note, seq),
+	FOREIGN KEY(id_note) REFERENCES notes(id_note)
+);
+
 CREATE TABLE IF NOT EXISTS web_account(
 	id_account INTEGER PRIMARY KEY,
-	username TEXT,
-	email TEXT,
-	password TEXT,
-	website TEXT,
+	username BLOB,
+	email BLOB,
+	password BLOB,
+	website BLOB,
 	id_user INTEGER,
+	record BLOB,
+	website_idx BLOB,
+	username_idx BLOB,
+	email_idx BLOB,
 	FOREIGN KEY(id_user) REFERENCES users(id_user)
 );
 
 CREATE TABLE IF NOT EXISTS contact_book(
 	id_book INTEGER PRIMARY KEY,
 	id_user INTEGER,
-	title TEXT,
-	detail TEXT,
+	title BLOB,
+	detail BLOB,
+	record BLOB,
 	FOREIGN KEY(id_user) REFERENCES users(id_user)
 );
 
 CREATE TABLE IF NOT EXISTS contact(
 	id_contact INTEGER PRIMARY KEY,
 	id_book INTEGER,
-	full_name TEXT,
-	address TEXT,
-	email TEXT,
-	phone_one TEXT,
-	phone_two TEXT,
-	webpage TEXT,
-	detail TEXT,
+	full_name BLOB,
+	address BLOB,
+	email BLOB,
+	phone_one BLOB,
+	phone_two BLOB,
+	webpage BLOB,
+	detail BLOB,
+	record BLOB,
 	FOREIGN KEY(id_book) REFERENCES agenda(id_book)
 );
 
 CREATE TABLE IF NOT EXISTS bank_account(
 	id_account INTEGER PRIMARY KEY,
 	id_user INTEGER,
-	bank_name TEXT,
-	username TEXT,
-	password TEXT,
-	pin TEXT,
-	cbu TEXT,
-	alias TEXT,
-	detail TEXT,
+	bank_name BLOB,
+	username BLOB,
+	password BLOB,
+	pin BLOB,
+	cbu BLOB,
+	alias BLOB,
+	detail BLOB,
+	record BLOB,
+	bank_name_idx BLOB,
 	FOREIGN KEY(id_user) REFERENCES users(id_user)
 );
 
 CREATE TABLE IF NOT EXISTS bank_card(
 	id_card INTEGER PRIMARY KEY,
 	id_account INTEGER,
-	entity TEXT,
-	card_number TEXT,
-	detail TEXT,
-	type TEXT,
-	security_code TEXT,
+	entity BLOB,
+	card_number BLOB,
+	detail BLOB,
+	type BLOB,
+	security_code BLOB,
+	record BLOB,
 	FOREIGN KEY(id_account) REFERENCES bank_account(id_account)
 );
 
+CREATE TABLE IF NOT EXISTS reencrypt_job(
+	id_user INTEGER PRIMARY KEY,
+	pending_key BLOB,
+	table_name TEXT,
+	last_id INTEGER,
+	FOREIGN KEY(id_user) REFERENCES users(id_user)
+);
+
+CREATE INDEX IF NOT EXISTS web_account_website_idx ON web_account(id_user, website_idx);
+CREATE INDEX IF NOT EXISTS web_account_username_idx ON web_account(id_user, username_idx);
+CREATE INDEX IF NOT EXISTS web_account_email_idx ON web_account(id_user, email_idx);
+CREATE INDEX IF NOT EXISTS bank_account_bank_name_idx ON bank_account(id_user, bank_name_idx);
+CREATE INDEX IF NOT EXISTS notes_id_user_idx ON notes(id_user);
+CREATE INDEX IF NOT EXISTS web_account_id_user_idx ON web_account(id_user);
+CREATE INDEX IF NOT EXISTS bank_account_id_user_idx ON bank_account(id_user);
+CREATE INDEX IF NOT EXISTS contact_book_id_user_idx ON contact_book(id_user);
+CREATE INDEX IF NOT EXISTS contact_id_book_idx ON contact(id_book);
+CREATE INDEX IF NOT EXISTS bank_card_id_account_idx ON bank_card(id_account);
+CREATE INDEX IF NOT EXISTS logs_event_user_idx ON logs(event_user);
+
+-- schema version, see DBSingleton.migrations
+PRAGMA user_version = 2;
+
 COMMIT;
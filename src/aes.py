@@ -1,32 +1,216 @@
 import base64
 import hashlib
+import hmac
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from Crypto import Random
 from Crypto.Cipher import AES
 
+# leading byte of every sealed row record, see seal_record
+RECORD_V1 = 1
+# leading byte of binary field tokens, legacy tokens are base64 text
+RAW_V1 = b'\x02'
+
+# scrypt cost picked by calibrate_kdf, measured once per process
+_calibrated_n = None
+
+def calibrate_kdf(target=0.5, r=8, p=1, max_n=2 ** 20):
+    # doubles the scrypt cost until one derivation takes about target seconds
+    # on this machine, returns the chosen n
+    n = 2 ** 12
+    while n < max_n:
+        started = time.perf_counter()
+        derive_key("calibration", {"kdf": "scrypt", "n": n, "r": r, "p": p, "salt": "00" * 16})
+        if time.perf_counter() - started >= target / 2:
+            break
+        n *= 2
+    return n
+
+def new_kdf_params(target=0.5):
+    global _calibrated_n
+    if _calibrated_n is None:
+        _calibrated_n = calibrate_kdf(target)
+    return {"kdf": "scrypt", "n": _calibrated_n, "r": 8, "p": 1, \
+        "salt": Random.get_random_bytes(16).hex()}
+
+def derive_key(passphrase, params):
+    # params as stored in users.kdf, None for the legacy unsalted SHA-256
+    if params is None:
+        return hashlib.sha256(passphrase.encode()).digest()
+    n, r, p = params["n"], params["r"], params["p"]
+    return hashlib.scrypt(passphrase.encode(), salt=bytes.fromhex(params["salt"]), \
+        n=n, r=r, p=p, maxmem=256 * n * r, dklen=32)
+
 class AESCipher(object):
+    # result sets from this size on are decrypted on a thread pool, the AES
+    # primitive releases the GIL so the chunks really run in parallel
+    parallel_min = 20000
+    chunk_size = 2048
 
-    def __init__(self, key): 
+    def __init__(self, key, kdf=None):
         self.bs = 32
-        self.key = hashlib.sha256(key.encode()).digest()
+        # derived once per session and reused by every encrypt/decrypt call
+        self.key = derive_key(key, kdf)
+        self.rng = Random.new()
+        self.index_key = None
+
+    @classmethod
+    def from_key(cls, key):
+        # cipher over raw key bytes, e.g. an unwrapped data-encryption key
+        cipher = cls.__new__(cls)
+        cipher.bs = 32
+        cipher.key = key
+        cipher.rng = Random.new()
+        cipher.index_key = None
+        return cipher
+
+    @staticmethod
+    def new_key():
+        return Random.get_random_bytes(32)
 
-    def encrypt(self, raw):
+    def wrap_key(self, key):
+        return self._seal(key, b'key')
+
+    def unwrap_key(self, wrapped):
+        # raises ValueError when this cipher is not the one that wrapped it
+        return self._open(memoryview(wrapped), b'key')
+
+    def encrypt(self, raw, binary=False):
         raw = self._pad(raw)
-        iv = Random.new().read(AES.block_size)
+        iv = self.rng.read(AES.block_size)
         cipher = AES.new(self.key, AES.MODE_CBC, iv)
+        if binary:
+            return RAW_V1 + iv + cipher.encrypt(raw.encode('utf-8'))
         return base64.b64encode(iv + cipher.encrypt(raw.encode('utf-8')))
 
     def decrypt(self, enc):
-        enc = base64.b64decode(enc)
+        enc = self._ciphertext(enc)
         iv = enc[:AES.block_size]
         cipher = AES.new(self.key, AES.MODE_CBC, iv)
         return self._unpad(cipher.decrypt(enc[AES.block_size:])).decode('utf-8')
 
+    def decrypt_many(self, items, keep=None, workers=None):
+        # items is either a column of tokens, or a cursor result when keep
+        # tells how many leading columns (ids) are returned untouched
+        return self._map_chunks(self._decrypt_chunk, items, keep, workers)
+
+    def seal_record(self, fields, aad=b''):
+        # a whole row serialized and sealed once with AES-GCM
+        return self._seal(json.dumps(fields, separators=(',', ':')).encode('utf-8'), aad)
+
+    def open_record(self, record, aad=b''):
+        return self._open_chunk([record], None, aad)[0]
+
+    def open_records(self, items, keep=None, aad=b'', workers=None):
+        # same calling convention as decrypt_many, one record per row
+        return self._map_chunks(lambda chunk, keep: self._open_chunk(chunk, keep, aad), \
+            items, keep, workers)
+
+    def seal_bytes(self, data, aad=b''):
+        # raw bytes sealed with the same format as the row records
+        return self._seal(data, aad)
+
+    def open_bytes(self, sealed, aad=b''):
+        return self._open(memoryview(sealed), aad)
+
+    def blind_index(self, value, field):
+        # keyed, deterministic digest of a normalized value, so equal values
+        # can be found with an indexed lookup without storing them in clear
+        if self.index_key is None:
+            self.index_key = hmac.new(self.key, b'blind index', hashlib.sha256).digest()
+        data = field.encode() + b'\0' + (value or "").strip().lower().encode('utf-8')
+        return hmac.new(self.index_key, data, hashlib.sha256).digest()[:16]
+
+    def _seal(self, data, aad):
+        # version (1) | nonce (12) | tag (16) | ciphertext
+        nonce = self.rng.read(12)
+        cipher = AES.new(self.key, AES.MODE_GCM, nonce=nonce)
+        cipher.update(aad)
+        enc, tag = cipher.encrypt_and_digest(data)
+        return bytes((RECORD_V1,)) + nonce + tag + enc
+
+    def _open(self, view, aad):
+        if view[0] != RECORD_V1:
+            raise ValueError("Unknown record version %d" % view[0])
+        cipher = AES.new(self.key, AES.MODE_GCM, nonce=view[1:13])
+        cipher.update(aad)
+        return cipher.decrypt_and_verify(view[29:], view[13:29])
+
+    def _map_chunks(self, func, items, keep, workers):
+        if not isinstance(items, list):
+            items = list(items)
+        if workers is None:
+            workers = os.cpu_count() if len(items) >= self.parallel_min else 0
+        if workers <= 1 or len(items) <= self.chunk_size:
+            return func(items, keep)
+        chunks = [items[i:i + self.chunk_size] for i in range(0, len(items), self.chunk_size)]
+        result = []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for chunk in pool.map(lambda chunk: func(chunk, keep), chunks):
+                result.extend(chunk)
+        return result
+
+    def _open_chunk(self, items, keep, aad):
+        new = AES.new
+        key = self.key
+        mode = AES.MODE_GCM
+        loads = json.loads
+
+        def unseal(record):
+            view = memoryview(record)
+            if view[0] != RECORD_V1:
+                raise ValueError("Unknown record version %d" % view[0])
+            cipher = new(key, mode, nonce=view[1:13])
+            cipher.update(aad)
+            return loads(cipher.decrypt_and_verify(view[29:], view[13:29]))
+
+        if keep is None:
+            return [unseal(record) for record in items]
+        return [list(row[:keep]) + unseal(row[keep]) for row in items]
+
+    def _decrypt_chunk(self, items, keep):
+        ciphertext = self._ciphertext
+        new = AES.new
+        key = self.key
+        mode = AES.MODE_CBC
+        bs = AES.block_size
+        # checked like decrypt does, bad data must not be truncated into a
+        # string that a rewrite would then seal
+        unpad = self._unpad
+
+        def decrypt(enc):
+            if enc is None:
+                return None
+            view = ciphertext(enc)
+            raw = new(key, mode, view[:bs]).decrypt(view[bs:])
+            return unpad(raw).decode('utf-8')
+
+        if keep is None:
+            return [decrypt(enc) for enc in items]
+        return [list(row[:keep]) + [decrypt(enc) for enc in row[keep:]] for row in items]
+
+    def wipe(self):
+        self.key = None
+        self.rng = None
+        self.index_key = None
+
+    @staticmethod
+    def _ciphertext(enc):
+        # binary tokens are used as they are, only legacy ones need base64
+        if enc[:1] == RAW_V1:
+            return memoryview(enc)[1:]
+        return memoryview(base64.b64decode(enc))
+
     def _pad(self, s):
         return s + (self.bs - len(s) % self.bs) * chr(self.bs - len(s) % self.bs)
 
-    @staticmethod
-    def _unpad(s):
-        return s[:-ord(s[len(s)-1:])]
+    def _unpad(self, s):
+        pad = s[-1] if s else 0
+        if not 0 < pad <= self.bs or s[-pad:] != bytes((pad,)) * pad:
+            raise ValueError("Invalid padding")
+        return s[:-pad]
 
 
 
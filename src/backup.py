@@ -0,0 +1,247 @@
+import os
+import json
+import zlib
+import struct
+import getpass
+import argparse
+from aes import AESCipher, new_kdf_params
+from db import DBManager
+from reencrypt import addUserArguments, loginUser
+
+# Backup of a user's whole vault to a compressed, encrypted archive, and the
+# matching restore. Both stream: the export reads the tables page by page and
+# the restore writes through the bulk insert path in batches, so memory stays
+# flat whatever the size of the vault. The archive is protected by its own
+# passphrase and can be restored into another user or another database.
+#
+#   python backup.py export vault.bak [--db path/to/main.db] [--user ID | --face]
+#   python backup.py restore vault.bak [--db path/to/main.db] [--user ID | --face]
+
+MAGIC = b"pyPass backup 1\n"
+# compressed bytes sealed per frame
+FRAME_SIZE = 65536
+
+# tables in the archive, in order, with the table holding their children
+# and the column linking them; parents are always written before children
+EXPORT_TABLES = [
+	("notes", None, None),
+	("web_account", None, None),
+	("bank_account", "bank_card", "id_account"),
+	("contact_book", "contact", "id_book"),
+]
+
+def frameAad(frame, final):
+	# the position and the last-frame flag are authenticated, so frames can
+	# not be reordered and a truncated archive is detected
+	return struct.pack(">QB", frame, final)
+
+
+class BackupWriter(object):
+	# one JSON line per entry, compressed as a single stream that is cut into
+	# frames sealed with a key derived from the backup passphrase
+	def __init__(self, out, passphrase):
+		kdf = new_kdf_params()
+		self.out = out
+		self.aes = AESCipher(passphrase, kdf)
+		self.compressor = zlib.compressobj()
+		self.pending = bytearray()
+		self.frame = 0
+		out.write(MAGIC + json.dumps(kdf).encode() + b"\n")
+
+	def write(self, entry):
+		line = json.dumps(entry, separators=(',', ':')).encode('utf-8') + b"\n"
+		self.pending += self.compressor.compress(line)
+		while len(self.pending) >= FRAME_SIZE:
+			self.writeFrame(bytes(self.pending[:FRAME_SIZE]), False)
+			del self.pending[:FRAME_SIZE]
+
+	def close(self):
+		self.pending += self.compressor.flush()
+		self.writeFrame(bytes(self.pending), True)
+		self.aes.wipe()
+
+	def writeFrame(self, data, final):
+		sealed = self.aes.seal_bytes(data, frameAad(self.frame, final))
+		self.out.write(struct.pack(">IB", len(sealed), final) + sealed)
+		self.frame += 1
+
+
+def readBackup(inp, passphrase):
+	# yields the entries of an archive, raises ValueError for a wrong
+	# passphrase or a damaged archive
+	if inp.readline() != MAGIC:
+		raise ValueError("Not a pyPass backup")
+	aes = AESCipher(passphrase, json.loads(inp.readline()))
+	decompressor = zlib.decompressobj()
+	pending = b""
+	frame = 0
+	final = False
+	while not final:
+		header = inp.read(5)
+		if len(header) < 5:
+			raise ValueError("Truncated backup")
+		size, final = struct.unpack(">IB", header)
+		data = aes.open_bytes(inp.read(size), frameAad(frame, final))
+		frame += 1
+		lines = (pending + decompressor.decompress(data)).split(b"\n")
+		pending = lines.pop()
+		for line in lines:
+			yield json.loads(line)
+	aes.wipe()
+
+def exportVault(dbManager, writer):
+	# returns the number of rows written, each parent row carries its old id
+	# so the restore can link its children again
+	count = 0
+	where = "id_user=?"
+	for table, childTable, childColumn in EXPORT_TABLES:
+		for page in dbManager.iterRecords(table, where, (dbManager.currentUser,)):
+			for row in page:
+				if table == "notes":
+					# the body follows the note chunk by chunk, notes from
+					# before chunking have it whole in the record
+					length = row.length if row.length is not None else len(row.content)
+					fields = [row.title, row.content[:dbManager.notePreviewSize], row.timestamp, length]
+				else:
+					fields = row[1:]
+				writer.write({"table": table, "id": row[0], "fields": fields})
+				count += 1
+				if table == "notes" and length > dbManager.notePreviewSize:
+					for chunk in dbManager.iterNoteContent(row[0]):
+						writer.write({"table": "note_chunk", "parent": row[0], "chunk": chunk})
+				if childTable is None:
+					continue
+				for children in dbManager.iterRecords(childTable, childColumn + "=?", (row[0],)):
+					for child in children:
+						writer.write({"table": childTable, "parent": row[0], "fields": child[1:]})
+					count += len(children)
+	dbManager.registerLog("Vault succesfully exported")
+	return count
+
+
+class VaultRestorer(object):
+	def __init__(self, dbManager, batchSize=5000):
+		self.dbManager = dbManager
+		self.batchSize = batchSize
+		# child table: parent table and linking column
+		self.children = {child: (table, column) for table, child, column in EXPORT_TABLES if child}
+
+	def run(self, entries):
+		# returns the number of rows restored. Everything goes in a single
+		# transaction: a damaged or truncated archive is only detected once
+		# its last frame is read, and then leaves the database as it was
+		dbManager = self.dbManager
+		# the log writer could not get at the database until the commit
+		dbManager.flushLogs()
+		try:
+			count = self.restore(entries)
+		except BaseException:
+			dbManager.conn.rollback()
+			# rows the inserts added to the cache were never committed
+			dbManager.cache.clear()
+			raise
+		dbManager.conn.commit()
+		dbManager.registerLog("%d rows succesfully restored from backup" % count)
+		return count
+
+	def restore(self, entries):
+		dbManager = self.dbManager
+		parentTables = [table for table, child, column in EXPORT_TABLES if child]
+		parents = {}
+		batch = []
+		group = None
+		count = 0
+		entries = iter(entries)
+		# the entry that ended the body of a note
+		pending = []
+		while True:
+			entry = pending.pop() if pending else next(entries, None)
+			if entry is None:
+				break
+			table, fields = entry["table"], entry["fields"]
+			count += 1
+			if table == "notes":
+				# notes are chunked, they are written one by one with their body
+				# streamed from the chunk entries that follow
+				if len(fields) == 3:
+					# archives that kept the body whole in the note
+					dbManager.insertNote(*fields, commit=False)
+					continue
+				content = self.noteContent(entries, pending)
+				dbManager.insertNoteChunks(*fields, content, commit=False)
+				# a short note takes none of them
+				for chunk in content:
+					pass
+				continue
+			if table in parentTables:
+				# the children that follow need the new id
+				self.flush(group, batch)
+				parents[table, entry["id"]] = dbManager.insertRecord(table, fields, \
+					"id_user", dbManager.currentUser, commit=False)
+				continue
+			if table in self.children:
+				parentTable, column = self.children[table]
+				key = (table, column, parents[parentTable, entry["parent"]])
+			else:
+				key = (table, "id_user", dbManager.currentUser)
+			if key != group or len(batch) >= self.batchSize:
+				self.flush(group, batch)
+				group = key
+			batch.append(fields)
+		self.flush(group, batch)
+		return count
+
+	def noteContent(self, entries, pending):
+		# the chunks of the note just read, the first entry after them is
+		# handed back through pending
+		for entry in entries:
+			if entry["table"] != "note_chunk":
+				pending.append(entry)
+				return
+			yield entry["chunk"]
+
+	def flush(self, group, batch):
+		if batch:
+			table, column, id_parent = group
+			self.dbManager.insertRecords(table, batch, column, id_parent, commit=False)
+			del batch[:]
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Export or restore a user's vault")
+	parser.add_argument("action", choices=["export", "restore"])
+	parser.add_argument("archive", help="backup file to write or read")
+	parser.add_argument("--db", default=DBManager.dbPath, help="database to use")
+	addUserArguments(parser)
+	args = parser.parse_args()
+
+	dbManager = DBManager()
+	dbManager.dbPath = args.db
+	login = loginUser(dbManager, args)
+	if login is None:
+		return
+	username, passphrase = login
+	archivePassphrase = getpass.getpass("Backup passphrase (empty for the same): ") or passphrase
+
+	if args.action == "export":
+		# written aside and moved in place, a failed export leaves no archive
+		with open(args.archive + ".tmp", "wb") as out:
+			writer = BackupWriter(out, archivePassphrase)
+			count = exportVault(dbManager, writer)
+			writer.close()
+		os.replace(args.archive + ".tmp", args.archive)
+		print("%d rows exported" % count)
+	else:
+		with open(args.archive, "rb") as inp:
+			try:
+				count = VaultRestorer(dbManager).run(readBackup(inp, archivePassphrase))
+			except ValueError as e:
+				print("Could not restore the backup: %s" % e)
+				count = None
+		if count is not None:
+			print("%d rows restored" % count)
+	dbManager.logout()
+	dbManager.close()
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,118 @@
+import sys
+import json
+import time
+import base64
+import string
+import random
+import platform
+import argparse
+import Crypto
+from Crypto import Random
+from Crypto.Cipher import AES
+from aes import AESCipher, derive_key, new_kdf_params
+
+# Microbenchmarks for aes.py. Every case reports ops/sec and, where it has a
+# payload, MB/s, so runs from different releases can be diffed:
+#
+#   python benchmark.py --output bench.json
+
+# from a short PIN to a multi-KB note
+SIZES = [4, 16, 64, 256, 1024, 4096, 16384]
+BULK_ROWS = 2000
+
+def measure(func, seconds, repeat=3):
+	# best of repeat runs, each calling func for about seconds
+	best = 0.0
+	for i in range(repeat):
+		calls = 0
+		started = time.perf_counter()
+		elapsed = 0.0
+		while elapsed < seconds:
+			func()
+			calls += 1
+			elapsed = time.perf_counter() - started
+		best = max(best, calls / elapsed)
+	return best
+
+def payload(size):
+	return "".join(random.choice(string.printable) for i in range(size))
+
+def result(name, ops, size=None, items=1):
+	entry = {"name": name, "ops_per_sec": round(ops, 1)}
+	if size is not None:
+		entry["size"] = size
+		entry["mb_per_sec"] = round(ops * items * size / 1e6, 3)
+	return entry
+
+def keyCases(seconds):
+	rng = Random.new()
+	kdf = new_kdf_params()
+	return [
+		result("kdf_sha256", measure(lambda: derive_key("passphrase", None), seconds)),
+		result("kdf_scrypt_n%d" % kdf["n"], measure(lambda: derive_key("passphrase", kdf), \
+			seconds, repeat=1)),
+		result("iv_random_new", measure(lambda: Random.new().read(AES.block_size), seconds)),
+		result("iv_cached_rng", measure(lambda: rng.read(AES.block_size), seconds)),
+	]
+
+def sizeCases(size, seconds):
+	aes = AESCipher("passphrase")
+	text = payload(size)
+	raw = text.encode('utf-8')
+	padded = aes._pad(text)
+	encoded = base64.b64encode(raw)
+	legacy = aes.encrypt(text)
+	binary = aes.encrypt(text, binary=True)
+	record = aes.seal_record([text])
+	cases = [
+		("pad", lambda: aes._pad(text)),
+		("unpad", lambda: aes._unpad(padded.encode('utf-8'))),
+		("b64encode", lambda: base64.b64encode(raw)),
+		("b64decode", lambda: base64.b64decode(encoded)),
+		("utf8_encode", lambda: text.encode('utf-8')),
+		("utf8_decode", lambda: raw.decode('utf-8')),
+		("encrypt_base64", lambda: aes.encrypt(text)),
+		("decrypt_base64", lambda: aes.decrypt(legacy)),
+		("encrypt_binary", lambda: aes.encrypt(text, binary=True)),
+		("decrypt_binary", lambda: aes.decrypt(binary)),
+		("seal_record", lambda: aes.seal_record([text])),
+		("open_record", lambda: aes.open_record(record)),
+	]
+	results = [result(name, measure(func, seconds), size) for name, func in cases]
+
+	column = [legacy] * BULK_ROWS
+	binaryColumn = [binary] * BULK_ROWS
+	records = [(i, record) for i in range(BULK_ROWS)]
+	results.append(result("decrypt_many_base64", \
+		measure(lambda: aes.decrypt_many(column, workers=0), seconds), size, BULK_ROWS))
+	results.append(result("decrypt_many_binary", \
+		measure(lambda: aes.decrypt_many(binaryColumn, workers=0), seconds), size, BULK_ROWS))
+	results.append(result("open_records", \
+		measure(lambda: aes.open_records(records, keep=1, workers=0), seconds), size, BULK_ROWS))
+	return results
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark the aes.py primitives")
+	parser.add_argument("--output", help="write the JSON report here instead of stdout")
+	parser.add_argument("--seconds", type=float, default=0.2, help="time spent per measurement")
+	args = parser.parse_args()
+
+	results = keyCases(args.seconds)
+	for size in SIZES:
+		results.extend(sizeCases(size, args.seconds))
+	report = {
+		"python": platform.python_version(),
+		"pycryptodome": Crypto.__version__,
+		"machine": platform.machine(),
+		"timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+		"results": results,
+	}
+	if args.output:
+		with open(args.output, "w") as out:
+			json.dump(report, out, indent=1)
+	else:
+		json.dump(report, sys.stdout, indent=1)
+		print()
+
+if __name__ == "__main__":
+	main()
@@ -1,409 +1,911 @@
 import sqlite3
 import io
+import json
+import struct
+import hashlib
 import numpy as np
-from aes import AESCipher
+from aes import AESCipher, new_kdf_params
+from records import TABLES, EntityCache
+from faceindex import openIndex
 import datetime
 import string
+import queue
+import threading
+import time
+import traceback
+
+class LogWriter(threading.Thread):
+	# writes the audit log on its own connection, everything queued within
+	# interval seconds goes into a single transaction. A batch refused because
+	# the database is locked is tried again retries times, backing off from
+	# retryDelay seconds, then kept for the next batch. Each try waits up to
+	# busyTimeout seconds for the lock, a flush is held back about 5s at most
+	retries = 3
+	retryDelay = 0.1
+	busyTimeout = 1.0
+
+	def __init__(self, dbPath, interval, queueSize):
+		super().__init__(daemon=True)
+		self.dbPath = dbPath
+		self.interval = interval
+		self.queue = queue.Queue(queueSize)
+		self.flushMarker = object()
+		self.insert = "INSERT INTO logs(%s, event_user) VALUES (%s)" % \
+			(", ".join(DBSingleton.recordColumns("logs")), \
+			",".join("?" * (len(DBSingleton.recordColumns("logs")) + 1)))
+
+	def write(self, values):
+		# blocks while the queue is full, a burst of events waits for the disk
+		self.queue.put(values)
+
+	def flush(self):
+		self.queue.put(self.flushMarker)
+		self.queue.join()
+
+	def stop(self):
+		self.queue.put(None)
+		self.join()
+
+	def run(self):
+		# every item taken from the queue is marked done whatever happens, so
+		# a flush never waits on a writer that failed
+		conn = None
+		pending = []
+		running = True
+		while running:
+			batch = [self.queue.get()]
+			try:
+				deadline = time.monotonic() + self.interval
+				# a flush or stop request writes what is queued right away
+				while batch[-1] is not None and batch[-1] is not self.flushMarker:
+					timeout = deadline - time.monotonic()
+					if timeout <= 0:
+						break
+					try:
+						batch.append(self.queue.get(timeout=timeout))
+					except queue.Empty:
+						break
+				pending += [item for item in batch if item is not None and item is not self.flushMarker]
+				if pending:
+					if conn is None:
+						conn = sqlite3.connect(self.dbPath, timeout=self.busyTimeout)
+					self.writeRows(conn, pending)
+					pending = []
+			except sqlite3.OperationalError:
+				# locked or not reachable, the rows go with the next batch
+				traceback.print_exc()
+			except Exception:
+				traceback.print_exc()
+				pending = []
+			finally:
+				for item in batch:
+					self.queue.task_done()
+			running = batch[-1] is not None
+		if pending:
+			print("%d audit log events could not be written" % len(pending))
+		if conn is not None:
+			conn.close()
+
+	def writeRows(self, conn, rows):
+		for attempt in range(self.retries + 1):
+			try:
+				conn.executemany(self.insert, rows)
+				conn.commit()
+				return
+			except sqlite3.OperationalError:
+				conn.rollback()
+				if attempt == self.retries:
+					raise
+				time.sleep(self.retryDelay * 2 ** attempt)
+
 
 class DBSingleton(object):
 	_instances = {}
+	dbPath = "../bin/main.db"
 	currentUser = -1
-	currentPassphrase = ""
+	currentCipher = None
+	# note bodies are stored as independently sealed chunks of this many
+	# characters, the notes table only keeps a preview for the list (which is
+	# the whole body for notes no longer than it)
+	noteChunkSize = 65536
+	notePreviewSize = 256
+	# face encodings are stored as a header (magic, dtype code, length) and
+	# the raw little-endian floats; rows from before hold np.save output
+	encodingHeader = struct.Struct("<4scH")
+	encodingMagic = b"ENC1"
+	encodingTypes = {b"f": "<f4", b"d": "<f8"}
+	encodingSize = 128
+	# rows per query of the paginated iterAll* readers
+	pageSize = 500
+	# decrypted rows kept in memory for the session
+	cacheSize = 50000
+	# compiled statements kept per connection, the record SQL is built from a
+	# few fixed templates so every statement the app runs stays cached
+	cachedStatements = 256
+	# audit log events are written in the background, grouped per interval
+	logInterval = 0.5
+	logQueueSize = 1000
+	# seconds a passphrase unlock should take, the KDF cost is calibrated to it
+	unlockTarget = 0.5
+	# encrypted tables, see records.py; recordTables keeps the id column and
+	# the per-field columns used by rows written before the sealed records
+	tables = TABLES
+	recordTables = dict((name, (table.idColumn, table.legacy)) for name, table in TABLES.items())
+	# rows belonging to a user, per encrypted table
+	recordScopes = [
+		("notes", "id_user=?"),
+		("web_account", "id_user=?"),
+		("bank_account", "id_user=?"),
+		("bank_card", "id_account IN (SELECT id_account FROM bank_account WHERE id_user=?)"),
+		("contact_book", "id_user=?"),
+		("contact", "id_book IN (SELECT id_book FROM contact_book WHERE id_user=?)"),
+		("note_chunk", "id_note IN (SELECT id_note FROM notes WHERE id_user=?)"),
+		("logs", "event_user=?"),
+	]
+	# fields with a keyed blind index column for exact-match lookups. Every
+	# column exists whatever this holds, it only decides which digests are
+	# written: set it to an empty dict to store none, rows written meanwhile
+	# are backfilled when read once it is set again. A field not listed here
+	# yet needs a migration adding its column
+	blindIndexes = {
+		"web_account": ("website", "username", "email"),
+		"bank_account": ("bank_name",),
+	}
+	# schema changes applied on connect to files with an older PRAGMA
+	# user_version, migration n takes a file to version n and doc/main_db.sql
+	# creates new files at the last one. A step is either an SQL statement or
+	# a (table, column, declaration) added when the column is missing. Steps
+	# are literal and never change once released, a later schema change is a
+	# new migration
+	migrations = [
+		# tables and columns added after the first release; files upgraded
+		# before the schema was versioned may have part of them
+		[
+			"CREATE TABLE IF NOT EXISTS reencrypt_job(id_user INTEGER PRIMARY KEY, \
+				pending_key BLOB, table_name TEXT, last_id INTEGER, \
+				FOREIGN KEY(id_user) REFERENCES users(id_user))",
+			"CREATE TABLE IF NOT EXISTS note_chunk(id_chunk INTEGER PRIMARY KEY, id_note INTEGER, \
+				seq INTEGER, digest BLOB, record BLOB, UNIQUE(id_note, seq), \
+				FOREIGN KEY(id_note) REFERENCES notes(id_note))",
+			("notes", "record", "BLOB"),
+			("web_account", "record", "BLOB"),
+			("bank_account", "record", "BLOB"),
+			("bank_card", "record", "BLOB"),
+			("contact_book", "record", "BLOB"),
+			("contact", "record", "BLOB"),
+			("logs", "record", "BLOB"),
+			("note_chunk", "record", "BLOB"),
+			("users", "wrapped_key", "BLOB"),
+			("users", "kdf", "TEXT"),
+			("web_account", "website_idx", "BLOB"),
+			("web_account", "username_idx", "BLOB"),
+			("web_account", "email_idx", "BLOB"),
+			("bank_account", "bank_name_idx", "BLOB"),
+			"CREATE INDEX IF NOT EXISTS web_account_website_idx ON web_account(id_user, website_idx)",
+			"CREATE INDEX IF NOT EXISTS web_account_username_idx ON web_account(id_user, username_idx)",
+			"CREATE INDEX IF NOT EXISTS web_account_email_idx ON web_account(id_user, email_idx)",
+			"CREATE INDEX IF NOT EXISTS bank_account_bank_name_idx ON bank_account(id_user, bank_name_idx)",
+		],
+		# every per-user query filters on these
+		[
+			"CREATE INDEX IF NOT EXISTS notes_id_user_idx ON notes(id_user)",
+			"CREATE INDEX IF NOT EXISTS web_account_id_user_idx ON web_account(id_user)",
+			"CREATE INDEX IF NOT EXISTS bank_account_id_user_idx ON bank_account(id_user)",
+			"CREATE INDEX IF NOT EXISTS contact_book_id_user_idx ON contact_book(id_user)",
+			"CREATE INDEX IF NOT EXISTS contact_id_book_idx ON contact(id_book)",
+			"CREATE INDEX IF NOT EXISTS bank_card_id_account_idx ON bank_card(id_account)",
+			"CREATE INDEX IF NOT EXISTS logs_event_user_idx ON logs(event_user)",
+		],
+	]
+
 	def __new__(class_, *args, **kwargs):
 		if class_ not in class_._instances:
 			class_._instances[class_] = super(DBSingleton, class_).__new__(class_, *args, **kwargs)
 		return class_._instances[class_]
 
 	def __init__(self):
+		# every DBManager() returns the same instance, keep its connection
+		if hasattr(self, "conn"):
+			return
 		self.conn = None
 		self.isConnected = False
-		sqlite3.register_adapter(np.ndarray, self.adapt_array)
-		sqlite3.register_converter("BLOB", self.convert_array)
-
-	def setUser(self, id_user, username, passphrase):
-		aes = AESCipher(passphrase)
-		username = aes.decrypt(username)
+		self.logWriter = None
+		self.cache = EntityCache(self.cacheSize)
+		self.knownFaces = None
+		# a login that was cancelled can still be loading the index when the
+		# next one starts, or when a user registers
+		self.knownFacesLock = threading.Lock()
+		self.registered = 0
+
+	def setUser(self, id_user, username, passphrase, resume=False):
+		unlocked = self.unlockUser(id_user, username, passphrase)
+		if unlocked is None:
+			return None
+		return self.openSession(id_user, passphrase, *unlocked, resume=resume)
+
+	def unlockUser(self, id_user, username, passphrase):
+		# the passphrase only unwraps the user's data key, rows and username
+		# are encrypted with that key. Returns the username, the data key
+		# cipher and whether the key still has to be wrapped, or None when
+		# the passphrase does not unlock the user; nothing is written
+		self.connect()
+		c = self.conn.cursor()
+		c.execute("SELECT wrapped_key, kdf FROM users WHERE id_user=?", (id_user,))
+		wrapped, kdf = c.fetchone()
+		c.close()
+		kek = AESCipher(passphrase, json.loads(kdf) if kdf else None)
+		if wrapped is not None:
+			try:
+				aes = AESCipher.from_key(kek.unwrap_key(wrapped))
+			except ValueError:
+				return None
+		elif self.checkLegacyKey(id_user, kek):
+			# users registered before envelope encryption keep their
+			# passphrase key as data key, it only gets wrapped here
+			aes = kek
+		else:
+			return None
+		try:
+			username = aes.decrypt(username)
+		except (ValueError, UnicodeDecodeError):
+			return None
+		return username, aes, wrapped is None or kdf is None
+
+	def openSession(self, id_user, passphrase, username, aes, unwrapped, resume=False):
+		# a user whose key rotation was interrupted has rows under two keys,
+		# only the run that finishes it (resume) may log in
+		if username and not resume and self.hasPendingRotation(id_user, aes):
+			raise ValueError("The key rotation of this user was interrupted, run " \
+				"reencrypt.py again to finish it before logging in")
 		if username:
+			if unwrapped:
+				self.storeWrappedKey(id_user, *self.wrapDataKey(passphrase, aes.key))
 			self.currentUser = id_user
-			self.currentPassphrase = passphrase
+			self.currentCipher = aes
+			self.cache.clear()
 			self.registerLog("Login")
 		return username
 
+	def hasPendingRotation(self, id_user, aes):
+		# an unfinished job that keeps the key (a format migration) leaves
+		# every row readable, only a new key splits them
+		c = self.conn.cursor()
+		c.execute("SELECT pending_key FROM reencrypt_job WHERE id_user=?", (id_user,))
+		job = c.fetchone()
+		c.close()
+		return job is not None and aes.unwrap_key(job[0]) != aes.key
+
+	def checkLegacyKey(self, id_user, aes):
+		# the newest sealed log of the user authenticates the key, if any
+		c = self.conn.cursor()
+		c.execute("SELECT record FROM logs WHERE event_user=? AND record IS NOT NULL \
+			ORDER BY id_log DESC LIMIT 1", (id_user,))
+		row = c.fetchone()
+		c.close()
+		if row is None:
+			return True
+		try:
+			aes.open_record(row[0], b"logs")
+		except ValueError:
+			return False
+		return True
+
+	def wrapDataKey(self, passphrase, key):
+		# wraps key under a fresh salt, returns the wrapped key and the KDF
+		# parameters to store with it
+		kdf = new_kdf_params(self.unlockTarget)
+		return AESCipher(passphrase, kdf).wrap_key(key), json.dumps(kdf)
+
+	def storeWrappedKey(self, id_user, wrapped, kdf):
+		c = self.conn.cursor()
+		c.execute("UPDATE users SET wrapped_key=?, kdf=? WHERE id_user=?", (wrapped, kdf, id_user))
+		self.conn.commit()
+		c.close()
+
+	def changePassphrase(self, old_passphrase, new_passphrase):
+		# rewraps the current user's data key, no row is re-encrypted
+		c = self.conn.cursor()
+		c.execute("SELECT wrapped_key, kdf FROM users WHERE id_user=?", (self.currentUser,))
+		wrapped, kdf = c.fetchone()
+		c.close()
+		try:
+			key = AESCipher(old_passphrase, json.loads(kdf)).unwrap_key(wrapped)
+		except ValueError:
+			return False
+		self.storeWrappedKey(self.currentUser, *self.wrapDataKey(new_passphrase, key))
+		self.registerLog("Passphrase succesfully changed")
+		return True
+
 	def logout(self):
 		self.registerLog("Logout")
+		self.flushLogs()
 		self.currentUser = -1
-		self.currentPassphrase = ""
-
-	def adapt_array(self, arr):
-		out = io.BytesIO()
-		np.save(out, arr)
-		out.seek(0)
-		return sqlite3.Binary(out.read())
-
-	def convert_array(self, text):
-		out = io.BytesIO(text)
-		out.seek(0)
-		return np.load(out)
+		self.cache.clear()
+		if self.currentCipher is not None:
+			self.currentCipher.wipe()
+		self.currentCipher = None
+
+	@classmethod
+	def packEncoding(class_, encoding):
+		if encoding is None:
+			return None
+		encoding = np.asarray(encoding)
+		code = b"f" if encoding.dtype == np.float32 else b"d"
+		return class_.encodingHeader.pack(class_.encodingMagic, code, encoding.size) + \
+			encoding.astype(class_.encodingTypes[code], copy=False).tobytes()
+
+	@classmethod
+	def unpackEncoding(class_, blob):
+		# a read-only view on the blob, nothing is copied
+		magic, code, size = class_.encodingHeader.unpack_from(blob)
+		if magic != class_.encodingMagic:
+			return np.load(io.BytesIO(blob))
+		return np.frombuffer(blob, class_.encodingTypes[code], size, class_.encodingHeader.size)
 
 	def connect(self):
 		if not self.isConnected:
-			self.conn = sqlite3.connect("../bin/main.db", detect_types=sqlite3.PARSE_DECLTYPES)
+			# one connection for the whole session, closed when the app exits
+			self.conn = sqlite3.connect(self.dbPath, cached_statements=self.cachedStatements)
 			self.isConnected = True
+			self.upgradeSchema()
 
 	def close(self):
+		if self.logWriter is not None:
+			self.logWriter.stop()
+			self.logWriter = None
 		if self.isConnected:
 			self.conn.close()
 			self.isConnected = False
 
+	def upgradeSchema(self):
+		c = self.conn.cursor()
+		c.execute("PRAGMA user_version")
+		version = c.fetchone()[0]
+		for number in range(version + 1, len(self.migrations) + 1):
+			# each migration is applied, and counted, in a single transaction
+			c.execute("BEGIN")
+			for step in self.migrations[number - 1]:
+				if isinstance(step, tuple):
+					table, column, decl = step
+					c.execute("PRAGMA table_info(%s)" % table)
+					if column not in [row[1] for row in c.fetchall()]:
+						c.execute("ALTER TABLE %s ADD COLUMN %s %s" % (table, column, decl))
+				else:
+					c.execute(step)
+			c.execute("PRAGMA user_version = %d" % number)
+			self.conn.commit()
+		c.close()
+
+	@classmethod
+	def recordColumns(class_, table):
+		# columns written for every row: the sealed record and its blind indexes
+		return ["record"] + [field + "_idx" for field in class_.blindIndexes.get(table, ())]
+
+	@classmethod
+	def recordValues(class_, aes, table, fields):
+		legacy = class_.recordTables[table][1]
+		values = [aes.seal_record(fields, table.encode())]
+		for field in class_.blindIndexes.get(table, ()):
+			values.append(aes.blind_index(fields[legacy.index(field)], table + "." + field))
+		return values
+
+	@classmethod
+	def recordUpdate(class_, table):
+		id_column, legacy = class_.recordTables[table]
+		assignments = [column + "=?" for column in class_.recordColumns(table)] + \
+			[column + "=NULL" for column in legacy]
+		return "UPDATE %s SET %s WHERE %s=?" % (table, ", ".join(assignments), id_column)
+
+	def sealRecord(self, table, fields):
+		return self.currentCipher.seal_record(fields, table.encode())
+
+	def insertRecord(self, table, fields, parent_column, id_parent, commit=True):
+		# without commit the row stays in the open transaction, for callers
+		# that commit or roll back a whole run of inserts
+		columns = self.recordColumns(table) + [parent_column]
+		c = self.conn.cursor()
+		c.execute("INSERT INTO %s(%s) VALUES (%s)" % (table, ", ".join(columns), \
+			",".join("?" * len(columns))), \
+			self.recordValues(self.currentCipher, table, fields) + [id_parent])
+		id_row = c.lastrowid
+		if commit:
+			self.conn.commit()
+		c.close()
+		self.cache.add(table, id_parent, self.tables[table].record(id_row, *fields))
+		return id_row
+
+	def insertRecords(self, table, rows, parent_column, id_parent, commit=True):
+		# bulk insertRecord: one executemany and one commit for all the rows,
+		# nothing is logged so the caller can record a single summary
+		aes = self.currentCipher
+		columns = self.recordColumns(table) + [parent_column]
+		c = self.conn.cursor()
+		c.executemany("INSERT INTO %s(%s) VALUES (%s)" % (table, ", ".join(columns), \
+			",".join("?" * len(columns))), \
+			[self.recordValues(aes, table, fields) + [id_parent] for fields in rows])
+		if commit:
+			self.conn.commit()
+		c.close()
+		# the new ids are not known, the group is read again when needed
+		self.cache.drop(table, id_parent)
+		self.cache.epoch += 1
+
+	def updateRecord(self, table, id_row, fields):
+		c = self.conn.cursor()
+		c.execute(self.recordUpdate(table), \
+			self.recordValues(self.currentCipher, table, fields) + [id_row])
+		self.conn.commit()
+		c.close()
+		self.cache.replace(table, self.tables[table].record(id_row, *fields))
+
+	def readRecords(self, table, where, params, limit=None):
+		# versioned reader: sealed records are opened in one pass, rows still in
+		# the per-field format or missing their blind indexes are rewritten in
+		# place
+		id_column, legacy = self.recordTables[table]
+		indexed = self.blindIndexes.get(table)
+		aes = self.currentCipher
+		c = self.conn.cursor()
+		columns = [id_column, "record", indexed[0] + "_idx IS NULL" if indexed else "0"] + list(legacy)
+		select = "SELECT %s FROM %s WHERE %s ORDER BY %s" % (", ".join(columns), table, where, \
+			id_column)
+		if limit is not None:
+			select += " LIMIT ?"
+			params += (limit,)
+		c.execute(select, params)
+		rows = c.fetchall()
+		sealed = [row for row in rows if row[1] is not None]
+		records = aes.open_records([row[:2] for row in sealed], keep=1, aad=table.encode())
+		rewrite = [record for record, row in zip(records, sealed) if row[2]]
+		if len(sealed) < len(rows):
+			old = [row[:1] + row[3:] for row in rows if row[1] is None]
+			old = aes.decrypt_many(old, keep=1)
+			rewrite += old
+			records = sorted(records + old, key=lambda row: row[0])
+		if rewrite:
+			c.executemany(self.recordUpdate(table), \
+				[self.recordValues(aes, table, row[1:]) + [row[0]] for row in rewrite])
+			self.conn.commit()
+		c.close()
+		record = self.tables[table].record
+		return [record(*row) for row in records]
+
+	def iterRecords(self, table, where, params, pageSize=None):
+		# keyset pagination over readRecords, each page is its own query that
+		# starts after the last id of the one before, so no cursor stays open
+		# between pages and memory is bounded by the page
+		id_column = self.recordTables[table][0]
+		pageSize = pageSize or self.pageSize
+		last = 0
+		while True:
+			page = self.readRecords(table, "(%s) AND %s>?" % (where, id_column), \
+				params + (last,), pageSize)
+			if page:
+				yield page
+			if len(page) < pageSize:
+				break
+			last = page[-1][0]
+
+	def findRecords(self, table, where, params, fields):
+		# exact, case-insensitive match. Blind indexed fields are looked up by
+		# their digest, rows written before the indexes existed are backfilled
+		# by one full read first; any other field, or every field while the
+		# indexes are off, is compared on the decrypted rows page by page
+		unknown = [field for field in fields if field not in self.tables[table].fields]
+		if unknown:
+			raise ValueError("%s has no field %s" % (table, ", ".join(unknown)))
+		indexed = [field for field in self.blindIndexes.get(table, ()) if field in fields]
+		aes = self.currentCipher
+		if indexed:
+			c = self.conn.cursor()
+			c.execute("SELECT 1 FROM %s WHERE %s AND %s_idx IS NULL LIMIT 1" % (table, where, \
+				self.blindIndexes[table][0]), params)
+			if c.fetchone() is not None:
+				self.readRecords(table, where, params)
+			c.close()
+		for field in indexed:
+			where += " AND %s_idx=?" % field
+			params += (aes.blind_index(fields[field], table + "." + field),)
+		scanned = [(field, (value or "").strip().lower()) for field, value in fields.items() \
+			if field not in indexed]
+		if not scanned:
+			return self.readRecords(table, where, params)
+		return [row for page in self.iterRecords(table, where, params) for row in page \
+			if all((getattr(row, field) or "").strip().lower() == value for field, value in scanned)]
+
+	def saveEntity(self, table, fields, id_parent=None):
+		# fields in record order; rows owned by the user need no parent
+		descriptor = self.tables[table]
+		id_row = self.insertRecord(table, fields, descriptor.parentColumn, \
+			self.currentUser if id_parent is None else id_parent)
+		self.registerLog(descriptor.label + " succesfully saved")
+		return id_row
+
+	def updateEntity(self, table, id_row, fields):
+		self.updateRecord(table, id_row, fields)
+		self.registerLog(self.tables[table].label + " succesfully updated")
+
+	def deleteEntity(self, table, id_row):
+		descriptor = self.tables[table]
+		c = self.conn.cursor()
+		for child, column in descriptor.children:
+			c.execute("DELETE FROM %s WHERE %s=?" % (child, column), (id_row,))
+			self.cache.drop(child, id_row)
+		c.execute("DELETE FROM %s WHERE %s=?" % (table, descriptor.idColumn), (id_row,))
+		self.conn.commit()
+		c.close()
+		self.cache.remove(table, id_row)
+		self.registerLog(descriptor.label + " succesfully deleted")
+
+	def iterEntities(self, table, id_parent=None, pageSize=None):
+		# served from the session cache when the group was read before
+		descriptor = self.tables[table]
+		id_parent = self.currentUser if id_parent is None else id_parent
+		pageSize = pageSize or self.pageSize
+		self.registerLog(descriptor.retrieved)
+		group = self.cache.get(table, id_parent)
+		if group is not None:
+			rows = list(group.values())
+			return (rows[i:i + pageSize] for i in range(0, len(rows), pageSize))
+		return self.cachePages(table, id_parent, \
+			self.iterRecords(table, descriptor.parentColumn + "=?", (id_parent,), pageSize))
+
+	def cachePages(self, table, id_parent, pages):
+		# passes the pages through and caches the group once all were read,
+		# unless something was written meanwhile
+		epoch = self.cache.epoch
+		rows = []
+		for page in pages:
+			if rows is not None:
+				rows.extend(page)
+				if len(rows) > self.cache.size:
+					rows = None
+			yield page
+		if rows is not None and epoch == self.cache.epoch:
+			self.cache.store(table, id_parent, rows)
+
+	def getEntities(self, table, id_parent=None):
+		return [row for page in self.iterEntities(table, id_parent) for row in page]
+
+	def getEntityChildren(self, table):
+		# the children of all the user's rows of table, read in one batch and
+		# grouped by parent id, so browsing them needs no query per parent
+		descriptor = self.tables[table]
+		child, column = descriptor.children[0]
+		parents = self.cache.get(table, self.currentUser)
+		if parents is not None:
+			groups = [(id_row, self.cache.get(child, id_row)) for id_row in parents]
+			if all(group is not None for id_row, group in groups):
+				self.registerLog(self.tables[child].retrieved)
+				return dict((id_row, list(group.values())) for id_row, group in groups if group)
+		where = "%s IN (SELECT %s FROM %s WHERE %s=?)" % (column, descriptor.idColumn, table, \
+			descriptor.parentColumn)
+		c = self.conn.cursor()
+		c.execute("SELECT %s, %s FROM %s WHERE %s" % (self.tables[child].idColumn, column, child, \
+			where), (self.currentUser,))
+		parents = dict(c.fetchall())
+		c.execute("SELECT %s FROM %s WHERE %s=?" % (descriptor.idColumn, table, \
+			descriptor.parentColumn), (self.currentUser,))
+		ids = [row[0] for row in c.fetchall()]
+		c.close()
+		grouped = {}
+		for row in self.readRecords(child, where, (self.currentUser,)):
+			grouped.setdefault(parents[row.id], []).append(row)
+		# parents without children are cached as empty groups
+		for id_row in ids:
+			self.cache.store(child, id_row, grouped.get(id_row, []))
+		self.registerLog(self.tables[child].retrieved)
+		return grouped
+
+	def findEntities(self, table, fields):
+		rows = self.findRecords(table, self.tables[table].parentColumn + "=?", \
+			(self.currentUser,), fields)
+		self.registerLog(self.tables[table].retrieved)
+		return rows
+
 	def registerUser(self, usr, pwd, enc):
-		aes = AESCipher(pwd)
-		usr = aes.encrypt(usr)
+		aes = AESCipher.from_key(AESCipher.new_key())
+		usr = aes.encrypt(usr, binary=True)
+		wrapped, kdf = self.wrapDataKey(pwd, aes.key)
 		c = self.conn.cursor()
-		c.execute("INSERT INTO users(username, encoding) VALUES (?,?)", (usr,enc))
+		c.execute("INSERT INTO users(username, encoding, wrapped_key, kdf) VALUES (?,?,?,?)", \
+			(usr, self.packEncoding(enc), wrapped, kdf))
 		self.conn.commit()
+		self.registered += 1
+		if self.knownFaces is not None:
+			self.knownFaces = self.knownFaces.add(c.lastrowid, usr, enc)
 		c.close()
 
-	def getKnownUsers(self):
+	def getUsernames(self, id_user=None):
+		# (id, encrypted username) of every user, or of only one
+		c = self.conn.cursor()
+		if id_user is None:
+			c.execute("SELECT id_user, username FROM users ORDER BY id_user")
+		else:
+			c.execute("SELECT id_user, username FROM users WHERE id_user=?", (id_user,))
+		users = c.fetchall()
+		c.close()
+		return users
+
+	def getKnownUsers(self, conn=None):
+		# encodings are copied straight into one preallocated float32
+		# N x encodingSize matrix, the one the face index searches; users
+		# without a usable encoding are left out
+		conn = conn or self.conn
 		known_ids = []
 		known_names = []
-		known_encodings = []
-		c = self.conn.cursor()
-		c.execute("SELECT * FROM users")
-		
+		c = conn.cursor()
+		c.execute("SELECT COUNT(*) FROM users")
+		known_encodings = np.empty((c.fetchone()[0], self.encodingSize), np.float32)
+		legacy = []
+		c.execute("SELECT id_user, username, encoding FROM users ORDER BY id_user LIMIT ?", \
+			(len(known_encodings),))
+
 		for row in c:
+			if row[2] is None:
+				continue
+			encoding = self.unpackEncoding(row[2])
+			if row[2][:len(self.encodingMagic)] != self.encodingMagic:
+				legacy.append((self.packEncoding(encoding), row[0]))
+			if encoding.size != self.encodingSize or not np.isfinite(encoding).all():
+				continue
+			known_encodings[len(known_ids)] = encoding
 			known_ids.append(row[0])
 			known_names.append(row[1])
-			known_encodings.append(row[2])
 
+		if legacy:
+			# np.save blobs are rewritten in the raw format once
+			c.executemany("UPDATE users SET encoding=? WHERE id_user=?", legacy)
+			conn.commit()
 		c.close()
-		return known_ids, known_names, known_encodings
+		return known_ids, known_names, known_encodings[:len(known_ids)]
+
+	def getKnownFaces(self, ownConnection=False):
+		# loaded once per process, registerUser adds to it; large indexes keep
+		# their partitions in a file beside the database. Reading the users
+		# and training the partitions takes seconds with many of them, so the
+		# UI loads the index on a worker thread, which passes ownConnection
+		# since the main connection only works on the thread that opened it
+		with self.knownFacesLock:
+			knownFaces = self.knownFaces
+			if knownFaces is None:
+				registered = self.registered
+				if ownConnection:
+					conn = sqlite3.connect(self.dbPath)
+					try:
+						known = self.getKnownUsers(conn)
+					finally:
+						conn.close()
+				else:
+					known = self.getKnownUsers()
+				knownFaces = openIndex(*known, path=self.dbPath + ".faces")
+				# not kept when somebody registered while it was read
+				if registered == self.registered:
+					self.knownFaces = knownFaces
+			return knownFaces
 
 	def saveNote(self, title, content, timestamp):
-		aes = AESCipher(self.currentPassphrase)
-		title = aes.encrypt(title)
-		content = aes.encrypt(content)
-		timestamp = aes.encrypt(timestamp)
-		c = self.conn.cursor()
-		c.execute("INSERT INTO notes(title, content, note_timestamp, id_user) VALUES (?,?,?,?)", \
-			(title,content,timestamp,self.currentUser))
-		id_note = c.lastrowid
-		self.conn.commit()
-		c.close()
+		id_note = self.insertNote(title, content, timestamp)
 		self.registerLog("Private note succesfully saved")
 		return id_note
 
+	def insertNote(self, title, content, timestamp, commit=True):
+		return self.insertNoteChunks(title, content[:self.notePreviewSize], timestamp, \
+			len(content), content, commit)
+
+	def insertNoteChunks(self, title, preview, timestamp, length, content, commit=True):
+		# a note whose body comes as any iterable of strings, with its preview
+		# and length known up front, so a long body is never held whole
+		salt = AESCipher.new_key().hex()
+		id_note = self.insertRecord("notes", [title, preview, timestamp, length, salt], \
+			"id_user", self.currentUser, commit)
+		if length > self.notePreviewSize:
+			self.writeNoteContent(id_note, salt, content, commit)
+		return id_note
+
 	def updateNote(self, id_note, title, content, timestamp):
-		aes = AESCipher(self.currentPassphrase)
-		title = aes.encrypt(title)
-		content = aes.encrypt(content)
-		timestamp = aes.encrypt(timestamp)
-		c = self.conn.cursor()
-		c.execute("UPDATE notes SET title=?, content=?, note_timestamp=? WHERE id_note=?", \
-			(title,content,timestamp,id_note))
-		self.conn.commit()
-		c.close()
+		note = self.readRecords("notes", "id_note=?", (id_note,))[0]
+		# notes from before chunking have no salt yet
+		salt = note.salt or AESCipher.new_key().hex()
+		self.updateRecord("notes", id_note, [title, content[:self.notePreviewSize], timestamp, \
+			len(content), salt])
+		self.writeNoteContent(id_note, salt, content if len(content) > self.notePreviewSize else "")
 		self.registerLog("Private note succesfully updated")
 
 	def getAllNotes(self):
+		# the content of a note is its preview, the whole body for short notes
+		return self.getEntities("notes")
+
+	def iterAllNotes(self, pageSize=None):
+		return self.iterEntities("notes", pageSize=pageSize)
+
+	def splitNoteContent(self, content):
+		# content is a string or any iterable of strings, chunks are yielded as
+		# soon as they are complete so only one is held at a time
+		if isinstance(content, str):
+			content = [content]
+		pending = ""
+		for piece in content:
+			pending += piece
+			while len(pending) >= self.noteChunkSize:
+				yield pending[:self.noteChunkSize]
+				pending = pending[self.noteChunkSize:]
+		if pending:
+			yield pending
+
+	def writeNoteContent(self, id_note, salt, content, commit=True):
+		# only chunks whose digest changed are sealed and written again; the
+		# digest is salted per note and the salt lives in the sealed note
+		salt = bytes.fromhex(salt)
 		c = self.conn.cursor()
-		c.execute("SELECT id_note, title, content, note_timestamp FROM notes WHERE id_user=?", \
-			(self.currentUser,))
-		notes = []
-		for row in c:
-			aes = AESCipher(self.currentPassphrase)
-			note = [row[0], aes.decrypt(row[1]), aes.decrypt(row[2]), aes.decrypt(row[3])]
-			notes.append(note)
+		c.execute("SELECT seq, id_chunk, digest FROM note_chunk WHERE id_note=?", (id_note,))
+		stored = {row[0]: row[1:] for row in c.fetchall()}
+		seq = 0
+		for chunk in self.splitNoteContent(content):
+			digest = hashlib.sha256(salt + chunk.encode('utf-8')).digest()
+			record = None
+			if seq not in stored:
+				record = self.sealRecord("note_chunk", [id_note, seq, chunk])
+				c.execute("INSERT INTO note_chunk(id_note, seq, digest, record) VALUES (?,?,?,?)", \
+					(id_note, seq, digest, record))
+			elif stored[seq][1] != digest:
+				record = self.sealRecord("note_chunk", [id_note, seq, chunk])
+				c.execute("UPDATE note_chunk SET digest=?, record=? WHERE id_chunk=?", \
+					(digest, record, stored[seq][0]))
+			seq += 1
+		c.execute("DELETE FROM note_chunk WHERE id_note=? AND seq>=?", (id_note, seq))
+		if commit:
+			self.conn.commit()
 		c.close()
-		self.registerLog("Private notes successfully retrieved from database")
-		return notes
+
+	def iterNoteContent(self, id_note):
+		# yields the body of a note one chunk at a time, each chunk is read and
+		# opened only when it is asked for
+		aes = self.currentCipher
+		seq = 0
+		while True:
+			c = self.conn.cursor()
+			c.execute("SELECT record FROM note_chunk WHERE id_note=? AND seq=?", (id_note, seq))
+			row = c.fetchone()
+			c.close()
+			if row is None:
+				break
+			chunk_note, chunk_seq, chunk = aes.open_record(row[0], b"note_chunk")
+			if chunk_note != id_note or chunk_seq != seq:
+				raise ValueError("Note chunk out of place")
+			yield chunk
+			seq += 1
+		if seq == 0:
+			# short notes and notes from before chunking are kept whole
+			note = self.readRecords("notes", "id_note=?", (id_note,))
+			if note:
+				yield note[0].content
+
+	def getNoteContent(self, id_note):
+		return "".join(self.iterNoteContent(id_note))
 
 	def deleteNote(self, id_note):
-		c = self.conn.cursor()
-		c.execute("DELETE FROM notes WHERE id_note=?", (id_note,))
-		self.conn.commit()
-		c.close()
-		self.registerLog("Private note succesfully deleted")
+		self.deleteEntity("notes", id_note)
 
 	def getAllWebAccounts(self):
-		c = self.conn.cursor()
-		c.execute("SELECT id_account, website, username, email, password FROM web_account WHERE id_user=?", \
-			(self.currentUser,))
-		accounts = []
-		for row in c:
-			aes = AESCipher(self.currentPassphrase)
-			account = [row[0], aes.decrypt(row[1]), aes.decrypt(row[2]), aes.decrypt(row[3]),\
-				aes.decrypt(row[4])]
-			accounts.append(account)
-		c.close()
-		self.registerLog("Web accounts succesfully retrieved from database")
-		return accounts
+		return self.getEntities("web_account")
+
+	def iterAllWebAccounts(self, pageSize=None):
+		return self.iterEntities("web_account", pageSize=pageSize)
 
 	def saveWebAccount(self, user, email, password, website):
-		aes = AESCipher(self.currentPassphrase)
-		user = aes.encrypt(user)
-		email = aes.encrypt(email)
-		password = aes.encrypt(password)
-		website = aes.encrypt(website)
-		c = self.conn.cursor()
-		c.execute("INSERT INTO web_account(username, email, password, website, id_user) VALUES (?,?,?,?,?)", \
-			(user, email, password, website, self.currentUser))
-		id_web = c.lastrowid
-		self.conn.commit()
-		c.close()
-		self.registerLog("Web account succesfully saved")
-		return id_web
+		return self.saveEntity("web_account", [website, user, email, password])
 
 	def updateWebAccount(self, id_web, user, email, website, password):
-		aes = AESCipher(self.currentPassphrase)
-		user = aes.encrypt(user)
-		email = aes.encrypt(email)
-		password = aes.encrypt(password)
-		website = aes.encrypt(website)
-		c = self.conn.cursor()
-		c.execute("UPDATE web_account SET username=?, email=?, password=?, website=? WHERE id_account=?", \
-			(user, email, password, website, id_web))
-		self.conn.commit()
-		c.close()
-		self.registerLog("Web account succesfully updated")
+		self.updateEntity("web_account", id_web, [website, user, email, password])
+
+	def findWebAccounts(self, **fields):
+		return self.findEntities("web_account", fields)
 
 	def deleteWebAccount(self, id_web):
-		c = self.conn.cursor()
-		c.execute("DELETE FROM web_account WHERE id_account=?", (id_web,))
-		self.conn.commit()
-		c.close()
-		self.registerLog("Web account succesfully deleted")
+		self.deleteEntity("web_account", id_web)
 
 	def getAllBankAccounts(self):
-		c = self.conn.cursor()
-		c.execute("SELECT id_account, bank_name, detail, username, password, pin, cbu, alias FROM bank_account WHERE id_user=?", \
-			(self.currentUser,))
-		accounts = []
-		for row in c:
-			aes = AESCipher(self.currentPassphrase)
-			account = [row[0], aes.decrypt(row[1]), aes.decrypt(row[2]), \
-				aes.decrypt(row[3]), aes.decrypt(row[4]), aes.decrypt(row[5]), aes.decrypt(row[6]), \
-				aes.decrypt(row[7])]
-			accounts.append(account)
-		c.close()
-		self.registerLog("Bank accounts succesfully retrieved from database")
-		return accounts
+		return self.getEntities("bank_account")
+
+	def iterAllBankAccounts(self, pageSize=None):
+		return self.iterEntities("bank_account", pageSize=pageSize)
 
 	def saveBankAccount(self, name, detail, user, password, pin, cbu, alias):
-		aes = AESCipher(self.currentPassphrase)
-		name = aes.encrypt(name)
-		detail = aes.encrypt(detail)
-		user = aes.encrypt(user)
-		password = aes.encrypt(password)
-		pin = aes.encrypt(pin)
-		cbu = aes.encrypt(cbu)
-		alias = aes.encrypt(alias)
-		c = self.conn.cursor()
-		c.execute("INSERT INTO bank_account(bank_name, detail, username, password, pin, cbu, alias, id_user) VALUES (?,?,?,?,?,?,?,?)", \
-			(name, detail, user, password, pin, cbu, alias, self.currentUser))
-		id_bank = c.lastrowid
-		self.conn.commit()
-		c.close()
-		self.registerLog("Bank account succesfully saved")
-		return id_bank
+		return self.saveEntity("bank_account", [name, detail, user, password, pin, cbu, alias])
 
 	def updateBankAccount(self, id_bank, name, detail, user, password, pin, cbu, alias):
-		aes = AESCipher(self.currentPassphrase)
-		name = aes.encrypt(name)
-		detail = aes.encrypt(detail)
-		user = aes.encrypt(user)
-		password = aes.encrypt(password)
-		pin = aes.encrypt(pin)
-		cbu = aes.encrypt(cbu)
-		alias = aes.encrypt(alias)
-		c = self.conn.cursor()
-		c.execute("UPDATE bank_account SET bank_name=?, detail=?, username=?, password=?, pin=?, cbu=?, alias=? WHERE id_account=?", \
-			(name, detail, user, password, pin, cbu, alias, id_bank))
-		self.conn.commit()
-		c.close()
-		self.registerLog("Bank account succesfully updated")
+		self.updateEntity("bank_account", id_bank, [name, detail, user, password, pin, cbu, alias])
+
+	def findBankAccounts(self, **fields):
+		return self.findEntities("bank_account", fields)
 
 	def deleteBankAccount(self, id_bank):
-		c = self.conn.cursor()
-		c.execute("DELETE FROM bank_card WHERE id_account=?", (id_bank,))
-		c.execute("DELETE FROM bank_account WHERE id_account=?", (id_bank,))
-		self.conn.commit()
-		c.close()
-		self.registerLog("Bank account succesfully deleted")
+		self.deleteEntity("bank_account", id_bank)
+
+	def getAllBankCardsByAccount(self):
+		return self.getEntityChildren("bank_account")
+
+	def getAllBankAccountsWithCards(self):
+		# (accounts, {id_account: cards})
+		return self.getAllBankAccounts(), self.getAllBankCardsByAccount()
 
 	def getAllBankCards(self, id_bank):
-		c = self.conn.cursor()
-		c.execute("SELECT id_card, entity, type, detail, card_number, security_code FROM bank_card WHERE id_account=?", \
-			(id_bank,))
-		cards = []
-		for row in c:
-			aes = AESCipher(self.currentPassphrase)
-			card = [row[0], aes.decrypt(row[1]), aes.decrypt(row[2]), aes.decrypt(row[3]), \
-				aes.decrypt(row[4]), aes.decrypt(row[5])]
-			cards.append(card)
-		c.close()
-		self.registerLog("Bank cards succesfully retrieved from database")
-		return cards
+		return self.getEntities("bank_card", id_bank)
+
+	def iterAllBankCards(self, id_bank, pageSize=None):
+		return self.iterEntities("bank_card", id_bank, pageSize)
 
 	def saveBankCard(self, entity, card_type, card_number, code, detail, id_bank):
-		aes = AESCipher(self.currentPassphrase)
-		entity = aes.encrypt(entity)
-		card_type = aes.encrypt(card_type)
-		card_number = aes.encrypt(card_number)
-		code = aes.encrypt(code)
-		detail = aes.encrypt(detail)
-		c = self.conn.cursor()
-		c.execute("INSERT INTO bank_card(entity, type, card_number, security_code, detail, id_account) VALUES (?,?,?,?,?,?)", \
-			(entity, card_type, card_number, code, detail, id_bank))
-		id_card = c.lastrowid
-		self.conn.commit()
-		c.close()
-		self.registerLog("Bank card succesfully saved")
-		return id_card
+		return self.saveEntity("bank_card", [entity, card_type, detail, card_number, code], id_bank)
 
 	def updateBankCard(self, id_card, entity, card_type, card_number, code, detail):
-		aes = AESCipher(self.currentPassphrase)
-		entity = aes.encrypt(entity)
-		card_type = aes.encrypt(card_type)
-		card_number = aes.encrypt(card_number)
-		code = aes.encrypt(code)
-		detail = aes.encrypt(detail)
-		c = self.conn.cursor()
-		c.execute("UPDATE bank_card SET entity=?, type=?, card_number=?, security_code=?, detail=? WHERE id_card=?",\
-			(entity, card_type, card_number, code, detail, id_card))
-		self.conn.commit()
-		c.close()
-		self.registerLog("Bank card succesfully updated")
+		self.updateEntity("bank_card", id_card, [entity, card_type, detail, card_number, code])
 
 	def deleteBankCard(self, id_card):
-		c = self.conn.cursor()
-		c.execute("DELETE FROM bank_card WHERE id_card=?", (id_card,))
-		self.conn.commit()
-		c.close()
-		self.registerLog("Bank card succesfully deleted")
+		self.deleteEntity("bank_card", id_card)
 
 	def getAllBooks(self):
-		c = self.conn.cursor()
-		c.execute("SELECT id_book, title, detail FROM contact_book WHERE id_user=?", (self.currentUser,))
-		agendas = []
-		for row in c:
-			aes = AESCipher(self.currentPassphrase)
-			agenda = [row[0], aes.decrypt(row[1]), aes.decrypt(row[2])]
-			agendas.append(agenda)
-		c.close()
-		self.registerLog("Contact books succesfully retrieved from database")
-		return agendas
+		return self.getEntities("contact_book")
+
+	def iterAllBooks(self, pageSize=None):
+		return self.iterEntities("contact_book", pageSize=pageSize)
 
 	def saveBook(self, title, detail):
-		aes = AESCipher(self.currentPassphrase)
-		title = aes.encrypt(title)
-		detail = aes.encrypt(detail)
-		c = self.conn.cursor()
-		c.execute("INSERT INTO contact_book(title, detail, id_user) VALUES (?,?,?)", \
-			(title, detail, self.currentUser))
-		id_agenda = c.lastrowid
-		self.conn.commit()
-		c.close()
-		self.registerLog("Contact book succesfully saved")
-		return id_agenda
+		return self.saveEntity("contact_book", [title, detail])
 
 	def updateBook(self, id_book, title, detail):
-		aes = AESCipher(self.currentPassphrase)
-		title = aes.encrypt(title)
-		detail = aes.encrypt(detail)
-		c = self.conn.cursor()
-		c.execute("UPDATE contact_book SET title=?, detail=? WHERE id_book=?", (title, detail, id_book))
-		self.conn.commit()
-		c.close()
-		self.registerLog("Contact book succesfully updated")
+		self.updateEntity("contact_book", id_book, [title, detail])
 
 	def deleteBook(self, id_book):
-		c = self.conn.cursor()
-		c.execute("DELETE FROM contact WHERE id_book=?", (id_book,))
-		c.execute("DELETE FROM contact_book WHERE id_book=?", (id_book,))
-		self.conn.commit()
-		c.close()
-		self.registerLog("Contact book succesfully deleted")
+		self.deleteEntity("contact_book", id_book)
 
 	def registerLog(self, event_detail):
-		self.connect()
 		timestamp = datetime.datetime.now()
 		timestamp = timestamp.strftime("%Y-%m-%d %H:%M:%S")
-		aes = AESCipher(self.currentPassphrase)
-		timestamp = aes.encrypt(timestamp)
-		event_detail = aes.encrypt(event_detail)
-		c = self.conn.cursor()
-		c.execute("INSERT INTO logs(event_timestamp, event_user, event_detail) VALUES (?,?,?)", \
-			(timestamp, self.currentUser, event_detail))
-		self.conn.commit()
-		c.close()
-		self.close()
+		# sealed here with the current key, stored later by the log writer
+		if self.logWriter is None:
+			self.logWriter = LogWriter(self.dbPath, self.logInterval, self.logQueueSize)
+			self.logWriter.start()
+		self.logWriter.write(self.recordValues(self.currentCipher, "logs", \
+			[timestamp, event_detail]) + [self.currentUser])
+
+	def flushLogs(self):
+		# returns once every event logged so far is committed, or kept for
+		# another try when the database stayed locked
+		if self.logWriter is not None:
+			self.logWriter.flush()
 
 	def getAllLogs(self):
-		c = self.conn.cursor()
-		c.execute("SELECT id_log, event_timestamp, event_detail FROM logs WHERE event_user=?", \
-			(self.currentUser,))
-		logs = []
-		for row in c:
-			aes = AESCipher(self.currentPassphrase)
-			log = [row[0], aes.decrypt(row[1]), aes.decrypt(row[2])]
-			logs.append(log)
-		c.close()
-		return logs
+		return [log for page in self.iterAllLogs() for log in page]
+
+	def iterAllLogs(self, pageSize=None):
+		self.flushLogs()
+		return self.iterRecords("logs", "event_user=?", (self.currentUser,), pageSize)
+
+	def getAllContactsByBook(self):
+		return self.getEntityChildren("contact_book")
+
+	def getAllBooksWithContacts(self):
+		# (books, {id_book: contacts})
+		return self.getAllBooks(), self.getAllContactsByBook()
 
 	def getAllContacts(self, id_book):
-		c = self.conn.cursor()
-		c.execute("SELECT id_contact, full_name, address, email, phone_one, phone_two, webpage, detail FROM contact WHERE id_book=?", \
-			(id_book,))
-		contacts = []
-		for row in c:
-			aes = AESCipher(self.currentPassphrase)
-			contact = [row[0], aes.decrypt(row[1]), aes.decrypt(row[2]), aes.decrypt(row[3]), aes.decrypt(row[4]), \
-				aes.decrypt(row[5]), aes.decrypt(row[6]), aes.decrypt(row[7])]
-			contacts.append(contact)
-		c.close()
-		self.registerLog("Contacts from contact book succesfully retrieved from database")
-		return contacts
+		return self.getEntities("contact", id_book)
+
+	def iterAllContacts(self, id_book, pageSize=None):
+		return self.iterEntities("contact", id_book, pageSize)
 
 	def deleteContact(self, id_contact):
-		c = self.conn.cursor()
-		c.execute("DELETE FROM contact WHERE id_contact=?", (id_contact,))
-		self.conn.commit()
-		c.close()
-		self.registerLog("Contact succesfully deleted")
+		self.deleteEntity("contact", id_contact)
 
 	def saveContact(self, name, address, email, phoneOne, phoneTwo, webPage, detail, id_book):
-		aes = AESCipher(self.currentPassphrase)
-		name = aes.encrypt(name)
-		address = aes.encrypt(address)
-		email = aes.encrypt(email)
-		phoneOne = aes.encrypt(phoneOne)
-		phoneTwo = aes.encrypt(phoneTwo)
-		webPage = aes.encrypt(webPage)
-		detail = aes.encrypt(detail)
-		c = self.conn.cursor()
-		c.execute("INSERT INTO contact(full_name, address, email, phone_one, phone_two, webpage, detail, id_book) VALUES (?,?,?,?,?,?,?,?)", \
-			(name, address, email, phoneOne, phoneTwo, webPage, detail, id_book))
-		id_contact = c.lastrowid
-		self.conn.commit()
-		c.close()
-		self.registerLog("Contact succesfully saved")
-		return id_contact
+		return self.saveEntity("contact", [name, address, email, phoneOne, phoneTwo, webPage, \
+			detail], id_book)
 
 	def updateContact(self, id_contact, name, address, email, phoneOne, phoneTwo, webPage, detail):
-		aes = AESCipher(self.currentPassphrase)
-		name = aes.encrypt(name)
-		address = aes.encrypt(address)
-		email = aes.encrypt(email)
-		phoneOne = aes.encrypt(phoneOne)
-		phoneTwo = aes.encrypt(phoneTwo)
-		webPage = aes.encrypt(webPage)
-		detail = aes.encrypt(detail)
-		c = self.conn.cursor()
-		c.execute("UPDATE contact SET full_name=?, address=?, email=?, phone_one=?, phone_two=?,webpage=?,detail=? WHERE id_contact=?",\
-			(name, address, email, phoneOne, phoneTwo, webPage, detail, id_contact))
-		self.conn.commit()
-		c.close()
-		self.registerLog("Contact succesfully updated")
+		self.updateEntity("contact", id_contact, [name, address, email, phoneOne, phoneTwo, \
+			webPage, detail])
 
 class DBManager(DBSingleton):
 	pass
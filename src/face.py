@@ -0,0 +1,320 @@
+import queue
+import threading
+import time
+import face_recognition
+import cv2
+import numpy as np
+
+# ======== Face Recognition ========
+
+def offer(slot, item):
+	# a one item queue keeps only the newest item, the stale one is dropped
+	while True:
+		try:
+			slot.put_nowait(item)
+			return
+		except queue.Full:
+			try:
+				slot.get_nowait()
+			except queue.Empty:
+				pass
+
+def createTracker():
+	# KCF is fast but only in builds with the contrib modules, MIL is in all
+	# of them; None when the build has neither
+	for name in ("TrackerKCF_create", "TrackerMIL_create"):
+		for module in (cv2, getattr(cv2, "legacy", None)):
+			factory = getattr(module, name, None)
+			if factory is not None:
+				return factory()
+	return None
+
+
+class FacePipeline(object):
+	# capture, detection and encoding each run on their own thread, joined by
+	# one slot queues: the camera is read at its own rate for the preview,
+	# and a stage that falls behind always takes the newest frame, the ones
+	# it could not keep up with are dropped
+	# seconds closing waits for the camera to be released
+	releaseWait = 2.0
+	def __init__(self, scale, model, rate, track=False, detectEvery=1, encodeEvery=1, camera=0):
+		self.scale = scale
+		self.model = model
+		self.rate = rate
+		self.track = track
+		self.detectEvery = detectEvery
+		self.encodeEvery = encodeEvery
+		self.camera = camera
+		self.stopped = threading.Event()
+		# set once the camera gives no more frames
+		self.closed = threading.Event()
+		self.previews = queue.Queue(1)
+		self.frames = queue.Queue(1)
+		self.located = queue.Queue(1)
+		self.results = queue.Queue(1)
+		self.threads = [threading.Thread(target=stage, daemon=True) \
+			for stage in (self.capture, self.detect, self.encode)]
+
+	def __enter__(self):
+		for thread in self.threads:
+			thread.start()
+		return self
+
+	def __exit__(self, *args):
+		# the camera is released before returning so it can be opened again
+		# right away, unless it is stuck in a read that does not return;
+		# detection and encoding finish the frame they are on and stop on
+		# their own
+		self.stopped.set()
+		self.threads[0].join(self.releaseWait)
+
+	def nextFrame(self, timeout=0.1):
+		# the newest camera frame, None when none came in within timeout
+		try:
+			return self.previews.get(timeout=timeout)
+		except queue.Empty:
+			return None
+
+	def nextFaces(self):
+		# (boxes, encodings) of the newest detection not seen yet, or None;
+		# boxes are (top, right, bottom, left) in camera frame coordinates and
+		# encodings is None for tracked frames that were not encoded
+		try:
+			return self.results.get_nowait()
+		except queue.Empty:
+			return None
+
+	def take(self, slot):
+		try:
+			return slot.get(timeout=0.1)
+		except queue.Empty:
+			return None
+
+	def capture(self):
+		video_capture = cv2.VideoCapture(self.camera)
+		try:
+			while not self.stopped.is_set():
+				ret, frame = video_capture.read()
+				if not ret:
+					# no camera, or it went away
+					break
+				offer(self.frames, frame)
+				# the preview is drawn on, detection gets the untouched frame
+				offer(self.previews, frame.copy())
+		finally:
+			video_capture.release()
+			self.closed.set()
+
+	def detect(self):
+		# rate caps the frames processed per second, none runs them back to
+		# back. When tracking, full detection only runs every detectEvery
+		# frames or once a face is lost, the frames in between move the boxes
+		# with the trackers and only every encodeEvery of them is encoded
+		interval = 1.0 / self.rate if self.rate else 0
+		due = 0
+		trackers = []
+		tracked = 0
+		while not self.stopped.wait(max(due - time.monotonic(), 0)):
+			frame = self.take(self.frames)
+			if frame is None:
+				continue
+			due = time.monotonic() + interval
+			small_frame = cv2.resize(frame, (0,0), fx=self.scale, fy=self.scale)
+			rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
+			face_locations = None
+			if trackers and tracked < self.detectEvery:
+				face_locations = self.follow(trackers, small_frame)
+			if face_locations is None:
+				face_locations = face_recognition.face_locations(rgb_small_frame, model=self.model)
+				trackers = self.startTrackers(small_frame, face_locations) if self.track else []
+				tracked = 0
+			offer(self.located, (rgb_small_frame, face_locations, tracked % self.encodeEvery == 0))
+			tracked += 1
+
+	def startTrackers(self, frame, face_locations):
+		trackers = []
+		for top, right, bottom, left in face_locations:
+			tracker = createTracker()
+			if tracker is None:
+				return []
+			tracker.init(frame, (left, top, right - left, bottom - top))
+			trackers.append(tracker)
+		return trackers
+
+	def follow(self, trackers, frame):
+		# the tracked boxes, None once any face is lost
+		height, width = frame.shape[:2]
+		face_locations = []
+		for tracker in trackers:
+			ok, (x, y, w, h) = tracker.update(frame)
+			top, left = max(int(y), 0), max(int(x), 0)
+			bottom, right = min(int(y + h), height), min(int(x + w), width)
+			if not ok or bottom <= top or right <= left:
+				return None
+			face_locations.append((top, right, bottom, left))
+		return face_locations
+
+	def encode(self):
+		while not self.stopped.is_set():
+			located = self.take(self.located)
+			if located is None:
+				continue
+			rgb_small_frame, face_locations, encode = located
+			face_encodings = None
+			if encode:
+				face_encodings = [self.encodeFace(rgb_small_frame, box) for box in face_locations]
+			boxes = [tuple(int(side / self.scale) for side in box) for box in face_locations]
+			offer(self.results, (boxes, face_encodings))
+
+	def encodeFace(self, frame, box):
+		# encoded from a crop around the box, with room for the landmarks
+		# that fall outside it
+		top, right, bottom, left = box
+		margin = (bottom - top) // 2
+		y, x = max(top - margin, 0), max(left - margin, 0)
+		roi = np.ascontiguousarray(frame[y:bottom + margin, x:right + margin])
+		return face_recognition.face_encodings(roi, [(top - y, right - x, bottom - y, left - x)])[0]
+
+
+class FaceRecognizer:
+	# frames are downscaled by scale before detection; model is "hog", or
+	# "cnn" which is more accurate but far slower without a GPU; rate caps
+	# frames processed per second, None runs them as fast as the CPU allows.
+	# With track faces are followed between full detections, which run every
+	# detectEvery frames, and encoded every encodeEvery frames
+	scale = 0.25
+	model = "hog"
+	rate = None
+	track = True
+	detectEvery = 10
+	encodeEvery = 3
+
+	def __init__(self, scale=None, model=None, rate=None, track=None, detectEvery=None, \
+		encodeEvery=None):
+		if scale is not None:
+			self.scale = scale
+		if model is not None:
+			self.model = model
+		if rate is not None:
+			self.rate = rate
+		if track is not None:
+			self.track = track
+		if detectEvery is not None:
+			self.detectEvery = detectEvery
+		if encodeEvery is not None:
+			self.encodeEvery = encodeEvery
+
+	def pipeline(self):
+		return FacePipeline(self.scale, self.model, self.rate, self.track, self.detectEvery, \
+			self.encodeEvery)
+
+	def drawFaces(self, frame, boxes, names):
+		font = cv2.FONT_HERSHEY_DUPLEX
+		for (top, right, bottom, left), name in zip(boxes, names):
+			cv2.rectangle(frame, (left, top), (right, bottom), (0, 0, 255), 2)
+			cv2.rectangle(frame, (left, bottom - 35), (right, bottom), (0, 0, 255), cv2.FILLED)
+			cv2.putText(frame, name, (left + 6, bottom - 6), font, 1.0, (255, 255, 255), 1)
+
+	def getEncoding(self):
+		cur_encoding = None
+		boxes = []
+		with self.pipeline() as pipeline:
+			while True:
+				frame = pipeline.nextFrame()
+				if frame is None:
+					if pipeline.closed.is_set():
+						cur_encoding = None
+						break
+					continue
+				faces = pipeline.nextFaces()
+				if faces is not None:
+					boxes, face_encodings = faces
+					if face_encodings:
+						cur_encoding = face_encodings[-1]
+
+				self.drawFaces(frame, boxes, ["Press \"W\""] * len(boxes))
+				cv2.putText(frame, "Press \"q\" to quit", (10,30), cv2.FONT_HERSHEY_DUPLEX, 0.8, \
+					(0,255,0), 1)
+				cv2.imshow('Face capture', frame)
+				key = cv2.waitKey(1) & 0xFF
+				if key == ord('q'):
+					cur_encoding = None
+					break
+				elif key == ord('w'):
+					break
+
+		cv2.destroyAllWindows()
+		return cur_encoding
+
+	def recognizeUser(self, knownFaces, cancelled=None, progress=None, timeout=None):
+		# runs until a known face is seen, cancelled() returns True or timeout
+		# seconds pass; progress(frame, status, elapsed) gets every annotated RGB
+		# frame instead of showing it in an OpenCV window. knownFaces is the
+		# index, or a function returning it that gives None while it is still
+		# being loaded, faces are only matched once it is there
+		started = time.monotonic()
+		boxes = []
+		face_names = []
+
+		with self.pipeline() as pipeline:
+			while not (cancelled and cancelled()):
+				# checked before waiting for a frame, a camera that stalls
+				# without closing gives none
+				elapsed = time.monotonic() - started
+				if timeout and elapsed > timeout:
+					break
+				index = knownFaces() if callable(knownFaces) else knownFaces
+				frame = pipeline.nextFrame()
+				if frame is None:
+					if pipeline.closed.is_set():
+						return None, None
+					continue
+
+				faces = pipeline.nextFaces()
+				if faces is not None:
+					boxes, face_encodings = faces
+					# tracked frames that were not encoded keep the last names
+					if face_encodings is not None and index is not None:
+						face_names = []
+						# every face of the frame against every user in one pass
+						for match in index.match(face_encodings):
+							if match is not None:
+								return match[0], match[1]
+							face_names.append("Unknown")
+
+				if progress:
+					self.drawFaces(frame, boxes, face_names)
+					status = "Loading known faces" if index is None else \
+						"Unknown face" if face_names else "Looking for a face"
+					progress(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), status, elapsed)
+		return None, None
+
+
+class FaceLoginThread(threading.Thread):
+	# runs recognizeUser away from the GTK main loop. loadFaces() builds the
+	# index of the known faces, which can take seconds with many users, on a
+	# thread of its own while the camera is already running. done(id_user,
+	# name) and progress(frame, status, elapsed) are called on this thread, it
+	# is up to the caller to hand them over to its own loop
+	def __init__(self, loadFaces, done, progress=None, timeout=None, recognizer=None):
+		super().__init__(daemon=True)
+		self.loadFaces = loadFaces
+		self.done = done
+		self.progress = progress
+		self.timeout = timeout
+		self.recognizer = recognizer or FaceRecognizer()
+		self.stopped = threading.Event()
+
+	def cancel(self):
+		self.stopped.set()
+
+	def run(self):
+		result = None, None
+		try:
+			loaded = []
+			loader = threading.Thread(target=lambda: loaded.append(self.loadFaces()), daemon=True)
+			loader.start()
+			result = self.recognizer.recognizeUser(lambda: loaded[0] if loaded else None, \
+				cancelled=self.stopped.is_set, progress=self.progress, timeout=self.timeout)
+		finally:
+			self.done(*result)
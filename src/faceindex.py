@@ -0,0 +1,217 @@
+import os
+import traceback
+import numpy as np
+
+# Indexes over the face encodings of the known users. The encodings are kept
+# as one contiguous float32 matrix; small sets are scanned whole with a single
+# matrix product, large ones are split in partitions so a face is only
+# compared with the users around it. The partitions are saved beside the
+# database and extended as users register, so they are trained only once.
+
+# largest distance that still counts as the same person, the value
+# face_recognition.compare_faces uses by default
+TOLERANCE = 0.6
+ENCODING_SIZE = 128
+# measured on one core, a face against 2000 users takes 0.04ms in a full
+# scan and 0.34ms with the partitions; the full scan only falls behind
+# somewhere between 10000 and 20000 users, where both take under 1ms, and
+# the partitions miss a few matches, so they are used from 20000 on
+PARTITION_THRESHOLD = 20000
+
+def rowNorms(matrix):
+	return np.einsum("ij,ij->i", matrix, matrix)
+
+def pairDistances(faces, matrix, norms):
+	# faces x rows euclidean distances: |a|^2 + |b|^2 - 2ab, where the cross
+	# term is the one BLAS product
+	squared = rowNorms(faces)[:, None] + norms[None, :] - 2 * (faces @ matrix.T)
+	return np.sqrt(np.maximum(squared, 0))
+
+def openIndex(ids, names, encodings, path=None):
+	index = BruteForceIndex(ids, names, encodings, path)
+	if len(index) >= PARTITION_THRESHOLD:
+		return PartitionIndex(index.ids, index.names, index.matrix, path)
+	return index
+
+
+class FaceIndex(object):
+	def __init__(self, ids, names, encodings, path=None):
+		# a float32 matrix is used as it is, without a copy. getKnownUsers
+		# already leaves out users without an encoding, the check for rows
+		# that are not finite only guards callers passing their own matrix
+		self.matrix = np.ascontiguousarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+		self.norms = rowNorms(self.matrix)
+		self.ids = list(ids)
+		self.names = list(names)
+		valid = np.isfinite(self.norms)
+		if not valid.all():
+			self.ids = [id_user for id_user, ok in zip(ids, valid) if ok]
+			self.names = [name for name, ok in zip(names, valid) if ok]
+			self.matrix = np.ascontiguousarray(self.matrix[valid])
+			self.norms = self.norms[valid]
+		self.path = path
+
+	def __len__(self):
+		return len(self.ids)
+
+	def add(self, id_user, name, encoding):
+		# returns the index to keep using, None once this one is outgrown; it
+		# is then opened again, which trains the partitions, on a thread where
+		# that does not hold anything up
+		if encoding is None:
+			return self
+		encoding = np.asarray(encoding, dtype=np.float32).reshape(1, ENCODING_SIZE)
+		if not np.isfinite(encoding).all():
+			return self
+		self.ids.append(id_user)
+		self.names.append(name)
+		self.matrix = np.concatenate([self.matrix, encoding])
+		self.norms = np.append(self.norms, rowNorms(encoding))
+		return self.added(len(self) - 1)
+
+	def match(self, faces, tolerance=TOLERANCE):
+		# (id, name, distance) of the closest known user for every face, None
+		# where nobody is within tolerance
+		faces = np.asarray(faces, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+		if not len(self) or not len(faces):
+			return [None] * len(faces)
+		rows, distances = self.search(faces)
+		return [(self.ids[row], self.names[row], float(distance)) if distance <= tolerance \
+			else None for row, distance in zip(rows, distances)]
+
+
+class BruteForceIndex(FaceIndex):
+	# exact, every face against every user
+	def search(self, faces):
+		distances = pairDistances(faces, self.matrix, self.norms)
+		rows = distances.argmin(axis=1)
+		return rows, distances[np.arange(len(faces)), rows]
+
+	def added(self, row):
+		if len(self) >= PARTITION_THRESHOLD:
+			return None
+		return self
+
+
+class PartitionIndex(FaceIndex):
+	# inverted file: the users are split in cells around k-means centroids and
+	# a face is compared with the users of its nearest cells only, about
+	# probes * sqrt(N) rows instead of N. Each cell keeps its own copy of its
+	# encodings so a probe is one product over contiguous memory
+	probes = 16
+	iterations = 10
+	# rows per centroid the k-means is trained on
+	sampleSize = 64
+	# cells are trained again once the index grows past this many times the
+	# users they were trained on
+	regrowth = 4
+
+	def __init__(self, ids, names, encodings, path=None):
+		super().__init__(ids, names, encodings, path)
+		if not self.load():
+			self.train()
+			self.save()
+
+	def train(self):
+		count = len(self)
+		cells = max(1, int(np.sqrt(count)))
+		rng = np.random.default_rng(0)
+		sample = self.matrix[rng.choice(count, min(count, cells * self.sampleSize), replace=False)]
+		centroids = sample[rng.choice(len(sample), cells, replace=False)]
+		for i in range(self.iterations):
+			assign = self.nearestCells(sample, centroids)
+			sums = np.zeros_like(centroids)
+			np.add.at(sums, assign, sample)
+			sizes = np.bincount(assign, minlength=cells)[:, None]
+			# a cell left empty keeps its centroid
+			centroids = np.where(sizes > 0, sums / np.maximum(sizes, 1), centroids)
+		self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+		self.trained = count
+		self.assign = self.nearestCells(self.matrix, self.centroids)
+		self.buildCells()
+
+	def nearestCells(self, rows, centroids, chunk=4096):
+		# in chunks, a rows x cells distance matrix of a large set would not fit
+		norms = rowNorms(centroids)
+		return np.concatenate([pairDistances(rows[start:start + chunk], centroids, norms). \
+			argmin(axis=1) for start in range(0, len(rows), chunk)] + [np.zeros(0, np.int64)])
+
+	def buildCells(self):
+		order = np.argsort(self.assign, kind="stable")
+		bounds = np.searchsorted(self.assign[order], np.arange(len(self.centroids) + 1))
+		self.cells = [order[bounds[cell]:bounds[cell + 1]] for cell in range(len(self.centroids))]
+		self.cellMatrices = [self.matrix[rows] for rows in self.cells]
+		self.cellNorms = [self.norms[rows] for rows in self.cells]
+		self.centroidNorms = rowNorms(self.centroids)
+
+	def search(self, faces):
+		distances = pairDistances(faces, self.centroids, self.centroidNorms)
+		probes = min(self.probes, len(self.centroids))
+		nearest = np.argpartition(distances, probes - 1, axis=1)[:, :probes]
+		rows = np.full(len(faces), -1)
+		best = np.full(len(faces), np.inf)
+		for face, cells in enumerate(nearest):
+			for cell in cells:
+				if not len(self.cells[cell]):
+					continue
+				found = pairDistances(faces[face:face + 1], self.cellMatrices[cell], \
+					self.cellNorms[cell])[0]
+				index = found.argmin()
+				if found[index] < best[face]:
+					rows[face], best[face] = self.cells[cell][index], found[index]
+		return rows, best
+
+	def added(self, row):
+		if len(self) > self.trained * self.regrowth:
+			return None
+		cell = self.nearestCells(self.matrix[row:row + 1], self.centroids)[0]
+		self.assign = np.append(self.assign, cell)
+		self.cells[cell] = np.append(self.cells[cell], row)
+		self.cellMatrices[cell] = np.concatenate([self.cellMatrices[cell], self.matrix[row:row + 1]])
+		self.cellNorms[cell] = np.append(self.cellNorms[cell], self.norms[row])
+		self.save()
+		return self
+
+	def fingerprint(self, count):
+		return self.matrix[:count].sum(axis=0, dtype=np.float64)
+
+	def save(self):
+		# only the ids and the cells are kept, names and encodings are always
+		# read from the database
+		if self.path is None:
+			return
+		try:
+			with open(self.path + ".tmp", "wb") as out:
+				np.savez(out, ids=np.array(self.ids, dtype=np.int64), assign=self.assign, \
+					centroids=self.centroids, trained=self.trained, \
+					fingerprint=self.fingerprint(len(self)))
+			os.replace(self.path + ".tmp", self.path)
+		except OSError:
+			# the cells are trained again on the next start
+			traceback.print_exc()
+
+	def load(self):
+		# the saved cells are reused when their users are still the first ones
+		# of the index, users registered since go to their nearest cell
+		if self.path is None:
+			return False
+		try:
+			with np.load(self.path) as saved:
+				ids, assign = saved["ids"], saved["assign"]
+				centroids, trained = saved["centroids"], int(saved["trained"])
+				fingerprint = saved["fingerprint"]
+		except (OSError, ValueError, KeyError):
+			return False
+		count = len(ids)
+		if not count or count > len(self) or ids.tolist() != self.ids[:count] or \
+			len(assign) != count or centroids.shape[1:] != (ENCODING_SIZE,) or \
+			not np.allclose(fingerprint, self.fingerprint(count)) or \
+			len(self) > trained * self.regrowth:
+			return False
+		self.centroids = centroids
+		self.trained = trained
+		self.assign = np.concatenate([assign, self.nearestCells(self.matrix[count:], centroids)])
+		self.buildCells()
+		if count < len(self):
+			self.save()
+		return True
@@ -0,0 +1,176 @@
+import os
+import csv
+import json
+import time
+import argparse
+import subprocess
+from db import DBManager
+from reencrypt import addUserArguments, loginUser
+
+# Bulk import of password manager exports: KeePass/KeePassXC CSV, Bitwarden
+# CSV or JSON and pass-style directory trees (plain text files, or .gpg ones
+# decrypted with the user's gpg). Entries are read as a stream and written in
+# batches, each batch sealed and inserted with a single executemany and
+# commit; one summary event is logged for the whole import.
+#
+#   python importer.py [--db path/to/main.db] [--format FORMAT] [--user ID | --face] export
+
+# logins are stored as web accounts, identities as contacts of a new book
+CONTACT_BOOK = "Imported contacts"
+
+def webAccount(website, username, password):
+	email = username if "@" in username else ""
+	return ("web_account", [website, username, email, password])
+
+def readKeePassCsv(rows):
+	# KeePassXC: Group, Title, Username, Password, URL, Notes, ...
+	# KeePass 2: Account, Login Name, Password, Web Site, Comments
+	for row in rows:
+		title = row.get("Title", row.get("Account", ""))
+		website = row.get("URL", row.get("Web Site", "")) or title
+		username = row.get("Username", row.get("Login Name", ""))
+		yield webAccount(website, username, row.get("Password", ""))
+
+def readBitwardenCsv(rows):
+	# folder, favorite, type, name, notes, fields, reprompt, login_uri,
+	# login_username, login_password, login_totp
+	for row in rows:
+		if row.get("type", "login") != "login":
+			yield None
+			continue
+		website = row.get("login_uri", "").split(",")[0] or row.get("name", "")
+		yield webAccount(website, row.get("login_username", ""), row.get("login_password", ""))
+
+def readBitwardenJson(path):
+	with open(path, encoding="utf-8") as export:
+		items = json.load(export).get("items", [])
+	for item in items:
+		if item.get("type") == 1:
+			login = item.get("login") or {}
+			uris = login.get("uris") or []
+			website = (uris[0].get("uri") if uris else "") or item.get("name", "")
+			yield webAccount(website or "", login.get("username") or "", login.get("password") or "")
+		elif item.get("type") == 4:
+			identity = item.get("identity") or {}
+			join = lambda keys: " ".join(identity[key] for key in keys if identity.get(key))
+			yield ("contact", [join(["firstName", "middleName", "lastName"]), \
+				join(["address1", "address2", "address3", "city", "state", "postalCode", "country"]), \
+				identity.get("email") or "", identity.get("phone") or "", "", "", item.get("notes") or ""])
+		else:
+			# secure notes and cards have no matching entity
+			yield None
+
+def readPassTree(root):
+	# the first line of an entry is the password, the rest "key: value" pairs;
+	# entries such as site/user take the website and username from the path
+	for directory, subdirs, files in os.walk(root):
+		subdirs.sort()
+		for name in sorted(files):
+			if name.startswith("."):
+				continue
+			path = os.path.join(directory, name)
+			entry, ext = os.path.splitext(os.path.relpath(path, root))
+			if ext == ".gpg":
+				text = subprocess.run(["gpg", "--quiet", "--batch", "--decrypt", path], \
+					check=True, stdout=subprocess.PIPE).stdout.decode("utf-8")
+			else:
+				with open(path, encoding="utf-8") as f:
+					text = f.read()
+			lines = text.splitlines() or [""]
+			fields = {}
+			for line in lines[1:]:
+				key, sep, value = line.partition(":")
+				if sep:
+					fields[key.strip().lower()] = value.strip()
+			parent = os.path.dirname(entry)
+			website = fields.get("url", fields.get("website", parent or entry))
+			username = fields.get("login", fields.get("username", fields.get("user", \
+				os.path.basename(entry) if parent else "")))
+			yield webAccount(website, username, lines[0])
+
+def readExport(path, format="auto"):
+	# yields (table, fields) entries, or None for entries that are skipped
+	if format == "auto":
+		if os.path.isdir(path):
+			format = "pass"
+		elif path.lower().endswith(".json"):
+			format = "bitwarden"
+		else:
+			format = "csv"
+	if format == "pass":
+		return readPassTree(path)
+	if format == "bitwarden" and path.lower().endswith(".json"):
+		return readBitwardenJson(path)
+	return readCsv(path, format)
+
+def readCsv(path, format):
+	with open(path, encoding="utf-8-sig", newline="") as export:
+		rows = csv.DictReader(export)
+		if format == "csv":
+			format = "bitwarden" if "login_uri" in (rows.fieldnames or []) else "keepass"
+		reader = readBitwardenCsv if format == "bitwarden" else readKeePassCsv
+		yield from reader(rows)
+
+
+class BulkImporter(object):
+	def __init__(self, dbManager, batchSize=5000):
+		self.dbManager = dbManager
+		self.batchSize = batchSize
+
+	def run(self, entries):
+		# returns how many rows went into each table and how many were skipped
+		dbManager = self.dbManager
+		parents = {"web_account": ("id_user", dbManager.currentUser)}
+		pending = {}
+		counts = {"web_account": 0, "contact": 0, "skipped": 0}
+		for entry in entries:
+			if entry is None or not any(entry[1]):
+				counts["skipped"] += 1
+				continue
+			table, fields = entry
+			if table not in parents:
+				id_book = dbManager.insertRecord("contact_book", [CONTACT_BOOK, ""], \
+					"id_user", dbManager.currentUser)
+				parents[table] = ("id_book", id_book)
+			batch = pending.setdefault(table, [])
+			batch.append(fields)
+			if len(batch) >= self.batchSize:
+				self.flush(table, batch, parents[table])
+				counts[table] += len(batch)
+				del batch[:]
+		for table, batch in pending.items():
+			if batch:
+				self.flush(table, batch, parents[table])
+				counts[table] += len(batch)
+		dbManager.registerLog("%d web accounts and %d contacts succesfully imported" % \
+			(counts["web_account"], counts["contact"]))
+		return counts
+
+	def flush(self, table, batch, parent):
+		self.dbManager.insertRecords(table, batch, parent[0], parent[1])
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Import a password manager export")
+	parser.add_argument("export", help="CSV or JSON export, or the root of a pass-style tree")
+	parser.add_argument("--db", default=DBManager.dbPath, help="database to import into")
+	parser.add_argument("--format", default="auto", \
+		choices=["auto", "csv", "keepass", "bitwarden", "pass"])
+	addUserArguments(parser)
+	args = parser.parse_args()
+
+	dbManager = DBManager()
+	dbManager.dbPath = args.db
+	if loginUser(dbManager, args) is None:
+		return
+	started = time.time()
+	counts = BulkImporter(dbManager).run(readExport(args.export, args.format))
+	elapsed = max(time.time() - started, 1e-6)
+	dbManager.logout()
+	dbManager.close()
+	imported = counts["web_account"] + counts["contact"]
+	print("%d web accounts, %d contacts imported, %d entries skipped (%.0f rows/s)" % \
+		(counts["web_account"], counts["contact"], counts["skipped"], imported / elapsed))
+
+if __name__ == "__main__":
+	main()
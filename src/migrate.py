@@ -0,0 +1,37 @@
+import sys
+import getpass
+from db import DBManager
+from reencrypt import ReEncryptionEngine, findUser, printProgress
+
+# One-shot migration of an existing main.db to binary storage: the rows of
+# every user that unlocks are rewritten as sealed records, usernames lose
+# their base64 encoding and the file is vacuumed to give the space back.
+# An interrupted migration resumes when it is started again.
+#
+#   python migrate.py [path/to/main.db]
+
+def main():
+	dbManager = DBManager()
+	if len(sys.argv) > 1:
+		dbManager.dbPath = sys.argv[1]
+
+	while True:
+		username = input("Username (empty to finish): ")
+		if not username:
+			break
+		passphrase = getpass.getpass("Passphrase: ")
+		if findUser(dbManager, username, passphrase, resume=True) is None:
+			print("No user matches that username and passphrase")
+			continue
+		# the passphrase lets a key rotation that was interrupted be finished
+		# on the way
+		ReEncryptionEngine(dbManager, progress=printProgress).run(passphrase=passphrase)
+		dbManager.logout()
+		print("%s migrated" % username)
+
+	dbManager.connect()
+	dbManager.conn.execute("VACUUM")
+	dbManager.close()
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,163 @@
+from collections import OrderedDict
+from itertools import zip_longest
+
+# Declarative description of the encrypted tables. DBManager builds its
+# read, insert, update and delete paths from these descriptors, and returns
+# rows as the compact record objects below.
+
+
+class Record(object):
+	# a decrypted row: the id, then the fields in record order. It indexes,
+	# slices and iterates like the lists rows used to be, so the list windows
+	# can keep treating it as one
+	__slots__ = ()
+
+	def __init__(self, *values):
+		# fields missing from older records are None
+		for name, value in zip_longest(self.__slots__, values):
+			setattr(self, name, value)
+
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			return [getattr(self, name) for name in self.__slots__[index]]
+		return getattr(self, self.__slots__[index])
+
+	def __len__(self):
+		return len(self.__slots__)
+
+	def __iter__(self):
+		for name in self.__slots__:
+			yield getattr(self, name)
+
+	def __repr__(self):
+		return "%s(%s)" % (type(self).__name__, ", ".join(repr(value) for value in self))
+
+
+class EntityCache(object):
+	# decrypted records of the session, grouped by (table, parent id) with each
+	# group holding every row of its parent in id order. Whole groups are
+	# evicted least recently used first once more than size rows are kept
+	def __init__(self, size):
+		self.size = size
+		self.groups = OrderedDict()
+		self.rows = 0
+		# bumped on every write, a group read across a write is not stored
+		self.epoch = 0
+
+	def get(self, table, id_parent):
+		group = self.groups.get((table, id_parent))
+		if group is not None:
+			self.groups.move_to_end((table, id_parent))
+		return group
+
+	def store(self, table, id_parent, records):
+		self.drop(table, id_parent)
+		if len(records) > self.size:
+			return
+		self.groups[table, id_parent] = OrderedDict((record.id, record) for record in records)
+		self.rows += len(records)
+		self.trim()
+
+	def drop(self, table, id_parent):
+		group = self.groups.pop((table, id_parent), None)
+		if group is not None:
+			self.rows -= len(group)
+
+	def add(self, table, id_parent, record):
+		self.epoch += 1
+		group = self.groups.get((table, id_parent))
+		if group is not None:
+			group[record.id] = record
+			self.rows += 1
+			self.trim()
+
+	def replace(self, table, record):
+		self.epoch += 1
+		for (name, id_parent), group in self.groups.items():
+			if name == table and record.id in group:
+				group[record.id] = record
+
+	def remove(self, table, id_row):
+		self.epoch += 1
+		for (name, id_parent), group in self.groups.items():
+			if name == table and id_row in group:
+				del group[id_row]
+				self.rows -= 1
+
+	def clear(self):
+		self.epoch += 1
+		self.groups.clear()
+		self.rows = 0
+
+	def trim(self):
+		while self.rows > self.size:
+			key, group = self.groups.popitem(last=False)
+			self.rows -= len(group)
+
+
+class Note(Record):
+	# content is the preview, the whole body is kept in note_chunk rows
+	__slots__ = ("id", "title", "content", "timestamp", "length", "salt")
+
+class WebAccount(Record):
+	__slots__ = ("id", "website", "username", "email", "password")
+
+class BankAccount(Record):
+	__slots__ = ("id", "bank_name", "detail", "username", "password", "pin", "cbu", "alias")
+
+class BankCard(Record):
+	__slots__ = ("id", "entity", "type", "detail", "card_number", "security_code")
+
+class ContactBook(Record):
+	__slots__ = ("id", "title", "detail")
+
+class Contact(Record):
+	__slots__ = ("id", "full_name", "address", "email", "phone_one", "phone_two", "webpage", \
+		"detail")
+
+class Log(Record):
+	__slots__ = ("id", "timestamp", "detail")
+
+class NoteChunk(Record):
+	__slots__ = ("id", "id_note", "seq", "chunk")
+
+
+class Table(object):
+	def __init__(self, name, idColumn, record, legacy=(), parentColumn="id_user", \
+		children=(), label=None, retrieved=None):
+		self.name = name
+		self.idColumn = idColumn
+		self.record = record
+		self.fields = record.__slots__[1:]
+		# per-field columns of rows written before the sealed record format
+		self.legacy = legacy
+		# rows belong to the user, or to a row of another table
+		self.parentColumn = parentColumn
+		# (table, column) rows deleted together with a row of this table
+		self.children = children
+		# log events: "<label> succesfully saved" and the message for reads
+		self.label = label
+		self.retrieved = retrieved
+
+
+TABLES = dict((table.name, table) for table in [
+	Table("notes", "id_note", Note, ("title", "content", "note_timestamp"), \
+		children=[("note_chunk", "id_note")], label="Private note", \
+		retrieved="Private notes successfully retrieved from database"),
+	Table("web_account", "id_account", WebAccount, ("website", "username", "email", "password"), \
+		label="Web account", retrieved="Web accounts succesfully retrieved from database"),
+	Table("bank_account", "id_account", BankAccount, ("bank_name", "detail", "username", \
+		"password", "pin", "cbu", "alias"), children=[("bank_card", "id_account")], \
+		label="Bank account", retrieved="Bank accounts succesfully retrieved from database"),
+	Table("bank_card", "id_card", BankCard, ("entity", "type", "detail", "card_number", \
+		"security_code"), parentColumn="id_account", label="Bank card", \
+		retrieved="Bank cards succesfully retrieved from database"),
+	Table("contact_book", "id_book", ContactBook, ("title", "detail"), \
+		children=[("contact", "id_book")], label="Contact book", \
+		retrieved="Contact books succesfully retrieved from database"),
+	Table("contact", "id_contact", Contact, ("full_name", "address", "email", "phone_one", \
+		"phone_two", "webpage", "detail"), parentColumn="id_book", label="Contact", \
+		retrieved="Contacts from contact book succesfully retrieved from database"),
+	Table("logs", "id_log", Log, ("event_timestamp", "event_detail"), parentColumn="event_user"),
+	Table("note_chunk", "id_chunk", NoteChunk, parentColumn="id_note"),
+])
@@ -0,0 +1,196 @@
+import os
+import time
+import getpass
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from aes import AESCipher
+from db import DBManager, DBSingleton
+
+# Re-encrypts every row of a user, either under a freshly generated data key
+# or under the same key when only the storage format changes. Tables are
+# walked in id-ranged batches that are decrypted and sealed on a process
+# pool; each batch is committed together with a checkpoint, so a run that is
+# interrupted resumes where it stopped the next time it is started. The
+# application should not be used by that user until the run has finished.
+#
+#   python reencrypt.py [path/to/main.db] [--user ID | --face]
+
+def reencryptBatch(old_key, new_key, table, rows):
+	# runs on the pool: rows are (id, record, legacy fields...) tuples
+	old = AESCipher.from_key(old_key)
+	new = AESCipher.from_key(new_key)
+	aad = table.encode()
+	sealed = old.open_records([row[:2] for row in rows if row[1] is not None], \
+		keep=1, aad=aad, workers=0)
+	legacy = old.decrypt_many([row[:1] + row[2:] for row in rows if row[1] is None], \
+		keep=1, workers=0)
+	return [DBSingleton.recordValues(new, table, row[1:]) + [row[0]] for row in sealed + legacy]
+
+
+class ReEncryptionEngine(object):
+	def __init__(self, dbManager, batchSize=1000, workers=None, progress=None):
+		self.dbManager = dbManager
+		self.batchSize = batchSize
+		self.workers = workers
+		self.progress = progress
+
+	def run(self, rotate=False, passphrase=None):
+		# a rotation needs the passphrase to wrap the new key at the end
+		dbManager = self.dbManager
+		aes = dbManager.currentCipher
+		id_user = dbManager.currentUser
+		tables = [table for table, where in dbManager.recordScopes]
+		# queued log events are sealed under the current key
+		dbManager.flushLogs()
+
+		c = dbManager.conn.cursor()
+		c.execute("SELECT pending_key, table_name, last_id FROM reencrypt_job WHERE id_user=?", \
+			(id_user,))
+		job = c.fetchone()
+		if job is None:
+			new_key = aes.new_key() if rotate else aes.key
+			start, last = 0, 0
+			c.execute("INSERT INTO reencrypt_job(id_user, pending_key, table_name, last_id) \
+				VALUES (?,?,?,?)", (id_user, aes.wrap_key(new_key), tables[0], 0))
+			dbManager.conn.commit()
+		else:
+			new_key = aes.unwrap_key(job[0])
+			start, last = tables.index(job[1]), job[2]
+		c.close()
+
+		if new_key != aes.key and passphrase is None:
+			raise ValueError("A key rotation needs the user's passphrase")
+
+		workers = self.workers or os.cpu_count()
+		with ProcessPoolExecutor(max_workers=workers) as pool:
+			for table, where in dbManager.recordScopes[start:]:
+				# a few batches stay in flight so reading, crypto and writing overlap
+				self.reencryptTable(pool, 2 * workers, table, where, last, aes.key, new_key)
+				last = 0
+		self.finish(new_key, passphrase)
+
+	def reencryptTable(self, pool, inFlight, table, where, last, old_key, new_key):
+		dbManager = self.dbManager
+		conn = dbManager.conn
+		id_user = dbManager.currentUser
+		id_column, legacy = dbManager.recordTables[table]
+		select = "SELECT %s FROM %s WHERE (%s) AND %s > ? ORDER BY %s LIMIT ?" % \
+			(", ".join([id_column, "record"] + list(legacy)), table, where, id_column, id_column)
+		update = dbManager.recordUpdate(table)
+
+		c = conn.cursor()
+		c.execute("SELECT COUNT(*) FROM %s WHERE (%s) AND %s > ?" % (table, where, id_column), \
+			(id_user, last))
+		total = c.fetchone()[0]
+		done = 0
+		started = time.time()
+		pending = deque()
+
+		while True:
+			c.execute(select, (id_user, last, self.batchSize))
+			rows = c.fetchall()
+			if rows:
+				last = rows[-1][0]
+				pending.append((pool.submit(reencryptBatch, old_key, new_key, table, rows), last))
+			if pending and (not rows or len(pending) >= inFlight):
+				future, batchLast = pending.popleft()
+				result = future.result()
+				c.executemany(update, result)
+				c.execute("UPDATE reencrypt_job SET table_name=?, last_id=? WHERE id_user=?", \
+					(table, batchLast, id_user))
+				conn.commit()
+				done += len(result)
+				if self.progress:
+					elapsed = max(time.time() - started, 1e-6)
+					self.progress(table, done, total, done / elapsed)
+			if not rows and not pending:
+				break
+		c.close()
+
+	def finish(self, new_key, passphrase):
+		dbManager = self.dbManager
+		aes = dbManager.currentCipher
+		new = AESCipher.from_key(new_key)
+		c = dbManager.conn.cursor()
+		c.execute("SELECT username FROM users WHERE id_user=?", (dbManager.currentUser,))
+		username = aes.decrypt(c.fetchone()[0])
+		c.execute("UPDATE users SET username=? WHERE id_user=?", \
+			(new.encrypt(username, binary=True), dbManager.currentUser))
+		if new_key != aes.key:
+			wrapped, kdf = dbManager.wrapDataKey(passphrase, new_key)
+			c.execute("UPDATE users SET wrapped_key=?, kdf=? WHERE id_user=?", \
+				(wrapped, kdf, dbManager.currentUser))
+		c.execute("DELETE FROM reencrypt_job WHERE id_user=?", (dbManager.currentUser,))
+		dbManager.conn.commit()
+		c.close()
+		dbManager.currentCipher = new
+
+
+def findUser(dbManager, username, passphrase, resume=False, id_user=None):
+	# with id_user only that user's key is derived, otherwise every user is
+	# tried until the username matches, one key derivation each. Only the
+	# matching user is logged in, nothing is written for the others. Raises
+	# ValueError for a user with an unfinished key rotation, unless the
+	# caller is the one resuming it
+	dbManager.connect()
+	for id_known, name in dbManager.getUsernames(id_user):
+		unlocked = dbManager.unlockUser(id_known, name, passphrase)
+		if unlocked is not None and unlocked[0] == username:
+			dbManager.openSession(id_known, passphrase, *unlocked, resume=resume)
+			return id_known
+	return None
+
+def addUserArguments(parser):
+	parser.add_argument("--user", type=int, help="id of the user, only that user is tried")
+	parser.add_argument("--face", action="store_true", \
+		help="find the user with the webcam, as the application does")
+
+def loginUser(dbManager, args, resume=False):
+	# asks for the username and passphrase, returns them once the user is
+	# logged in, None otherwise
+	id_user = args.user
+	if args.face:
+		# cv2 and face_recognition are only needed for this
+		from face import FaceRecognizer
+		dbManager.connect()
+		id_user, name = FaceRecognizer().recognizeUser(dbManager.getKnownFaces(), timeout=30)
+		if id_user is None:
+			print("No known face was recognized")
+			return None
+	username = input("Username: ")
+	passphrase = getpass.getpass("Passphrase: ")
+	try:
+		found = findUser(dbManager, username, passphrase, resume, id_user)
+	except ValueError as e:
+		print(e)
+		return None
+	if found is None:
+		print("No user matches that username and passphrase")
+		return None
+	if id_user is None:
+		print("User id %d, pass --user %d to skip the search next time" % (found, found))
+	return username, passphrase
+
+def printProgress(table, done, total, rate):
+	print("%s: %d/%d rows (%.0f rows/s)" % (table, done, total, rate))
+
+def main():
+	parser = argparse.ArgumentParser(description="Rotate the data key of a user")
+	parser.add_argument("db", nargs="?", default=DBManager.dbPath, help="database to use")
+	addUserArguments(parser)
+	args = parser.parse_args()
+
+	dbManager = DBManager()
+	dbManager.dbPath = args.db
+	login = loginUser(dbManager, args, resume=True)
+	if login is None:
+		return
+	username, passphrase = login
+	engine = ReEncryptionEngine(dbManager, progress=printProgress)
+	engine.run(rotate=True, passphrase=passphrase)
+	dbManager.logout()
+	print("Data key of %s rotated" % username)
+
+if __name__ == "__main__":
+	main()
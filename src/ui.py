@@ -1,11 +1,10 @@
 import gi
 gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk, Gdk
-import face_recognition
-import cv2
-import numpy as np
+gi.require_version('GdkPixbuf', '2.0')
+from gi.repository import Gtk, Gdk, GdkPixbuf, GLib
 import os.path
 from db import DBManager
+from face import FaceRecognizer, FaceLoginThread
 import datetime
 import string
 import random
@@ -18,9 +17,12 @@ class UIManager:
 	def startUI():
 		builder = Gtk.Builder()
 		builder.add_from_file("../bin/ui.glade")
+		dbManager = DBManager()
+		dbManager.connect()
 		window = MenuWindow(builder)
 		window.showWindow()
 		Gtk.main()
+		dbManager.close()
 
 
 # ======== Parent Classes ========
@@ -43,6 +45,9 @@ class ListWindow(StandardWindow):
 		self.tree = tree
 		self.liststore = liststore
 		self.searchEntry = searchEntry
+		self.loader = None
+		# ids added to the list while later pages are still loading
+		self.added = set()
 
 		self.clipboard = Gtk.Clipboard.get(Gdk.SELECTION_CLIPBOARD)
 
@@ -74,13 +79,52 @@ class ListWindow(StandardWindow):
 		self.modelFilter.refilter()
 
 	def fillList(self, elements):
+		# detached while filling so the sort and filter models are not
+		# recomputed on every single append
+		model = self.tree.get_model()
+		self.tree.set_model(None)
 		for element in elements:
-			self.liststore.append(list(element))
+			self.appendRow(element)
+		self.tree.set_model(model)
+
+	def fillPages(self, pages):
+		# the first page is shown right away, the rest is read and appended
+		# from the main loop while it is idle
+		self.stopLoading()
+		pages = iter(pages)
+		self.fillList(next(pages, []))
+		self.loader = GLib.idle_add(self.loadNextPage, pages)
+
+	def loadNextPage(self, pages):
+		page = next(pages, None)
+		if page is None:
+			self.loader = None
+			self.added.clear()
+			return False
+		for element in page:
+			# a row added meanwhile is already in the list, its page brings
+			# it again
+			if element[0] not in self.added:
+				self.appendRow(element)
+		return True
+
+	def stopLoading(self):
+		if self.loader is not None:
+			GLib.source_remove(self.loader)
+			self.loader = None
+		self.added.clear()
 
 	def addToList(self, toAdd):
-		self.liststore.append(toAdd)
+		if self.loader is not None:
+			self.added.add(toAdd[0])
+		self.appendRow(toAdd)
+
+	def appendRow(self, row):
+		# records can carry more fields than the list has columns
+		self.liststore.append(list(row[:self.liststore.get_n_columns()]))
 
 	def onClose(self, widget, *args):
+		self.stopLoading()
 		self.liststore.clear()
 		if self.searchEntry:
 			self.searchEntry.set_text("")
@@ -112,15 +156,17 @@ class MenuWindow(StandardWindow):
 		self.registerWindow = RegisterWindow(builder, self)
 		self.passWindow = PassphraseWindow(builder, self)
 		self.mainWindow = MainWindow(builder, self)
+		self.faceLoginWindow = FaceLoginWindow(builder, self)
 
 	def onLoginClicked(self, button):
-		recognizer = FaceRecognizer()
 		self.window.hide()
-		id_user, name = recognizer.recognizeUser()
-		self.window.show_all()
+		self.faceLoginWindow.showWindow()
+
+	def onFaceRecognized(self, id_user, name):
 		if name is not None:
-			self.window.hide()
 			self.passWindow.showWindow(id_user, name)
+		else:
+			self.window.show_all()
 
 	def onRegisterClicked(self, button):
 		self.window.hide()
@@ -130,6 +176,77 @@ class MenuWindow(StandardWindow):
 		self.mainWindow.showWindow()
 
 
+class FaceLoginWindow(StandardWindow):
+	# seconds the camera looks for a known face before giving up
+	loginTimeout = 30
+
+	def __init__(self, builder, parent):
+		window = builder.get_object("window_face_login")
+		super().__init__(window, parent)
+
+		self.preview = builder.get_object("img_face_login_preview")
+		self.status = builder.get_object("lbl_face_login_status")
+		self.progressBar = builder.get_object("progress_face_login")
+		self.cancelButton = builder.get_object("btn_face_login_cancel")
+
+		self.window.connect("delete-event", self.onClose)
+		self.cancelButton.connect("clicked", self.onClose)
+
+		self.worker = None
+		self.framePending = False
+
+	def showWindow(self):
+		# the capture starts on its own thread right away and the known faces
+		# are loaded beside it, the window is drawn in the meantime
+		dbManager = DBManager()
+		worker = FaceLoginThread(lambda: dbManager.getKnownFaces(ownConnection=True), \
+			lambda id_user, name: GLib.idle_add(self.onResult, worker, id_user, name), \
+			lambda frame, status, elapsed: self.postFrame(worker, frame, status, elapsed), \
+			self.loginTimeout)
+		self.worker = worker
+		self.framePending = False
+		worker.start()
+		self.status.set_text("Starting camera")
+		self.progressBar.set_fraction(0)
+		super().showWindow()
+
+	def postFrame(self, worker, frame, status, elapsed):
+		# called on the capture thread, frames are dropped while the main loop
+		# has not drawn the previous one yet
+		if not self.framePending:
+			self.framePending = True
+			GLib.idle_add(self.onFrame, worker, frame, status, elapsed)
+
+	def onFrame(self, worker, frame, status, elapsed):
+		self.framePending = False
+		if worker is self.worker:
+			height, width = frame.shape[:2]
+			pixbuf = GdkPixbuf.Pixbuf.new_from_bytes(GLib.Bytes.new(frame.tobytes()), \
+				GdkPixbuf.Colorspace.RGB, False, 8, width, height, width * 3)
+			width, height = self.preview.get_size_request()
+			self.preview.set_from_pixbuf(pixbuf.scale_simple(width, height, \
+				GdkPixbuf.InterpType.BILINEAR))
+			self.status.set_text(status)
+			self.progressBar.set_fraction(min(elapsed / self.loginTimeout, 1.0))
+		return False
+
+	def onResult(self, worker, id_user, name):
+		# results of a cancelled capture are ignored
+		if worker is self.worker:
+			self.worker = None
+			self.hideWindow()
+			self.parent.onFaceRecognized(id_user, name)
+		return False
+
+	def onClose(self, widget, *args):
+		if self.worker is not None:
+			self.worker.cancel()
+			self.worker = None
+		self.hideWindow()
+		self.parent.showWindow()
+		return True
+
+
 class MainWindow(StandardWindow):
 	def __init__(self, builder, parent):
 		window = builder.get_object("window_main")
@@ -140,6 +257,7 @@ class MainWindow(StandardWindow):
 		self.bookButton = builder.get_object("menu_main_book")
 		self.bankButton = builder.get_object("menu_main_bank")
 		self.logsButton = builder.get_object("menu_main_logs")
+		self.passphraseButton = builder.get_object("menu_main_passphrase")
 		self.logoutButton = builder.get_object("menu_main_logout")
 
 		self.window.connect("delete-event", self.onClose)
@@ -148,6 +266,7 @@ class MainWindow(StandardWindow):
 		self.bookButton.connect("activate", self.showBook)
 		self.bankButton.connect("activate", self.showBank)
 		self.logsButton.connect("activate", self.showLogs)
+		self.passphraseButton.connect("activate", self.showPassphrase)
 		self.logoutButton.connect("activate", self.onLogout)
 
 		self.genPassWindow = PassGenerateWindow(builder)
@@ -157,6 +276,7 @@ class MainWindow(StandardWindow):
 		self.bankWindow = BankAccountsListWindow(builder, self, self.genPassWindow, self.genPinWindow)
 		self.bookWindow = BookListWindow(builder, self)
 		self.logsWindow = LogListWindow(builder, self)
+		self.passphraseWindow = ChangePassphraseWindow(builder, self)
 
 	def onLogout(self, widget):
 		dbManager = DBManager()
@@ -186,6 +306,9 @@ class MainWindow(StandardWindow):
 	def showLogs(self, widget):
 		self.logsWindow.showWindow()
 
+	def showPassphrase(self, widget):
+		self.passphraseWindow.showWindow()
+
 
 class NotesListWindow(ListWindow):
 	def __init__(self, builder, parent):
@@ -218,10 +341,7 @@ class NotesListWindow(ListWindow):
 
 	def fillList(self):
 		dbManager = DBManager()
-		dbManager.connect()
-		notes = dbManager.getAllNotes()
-		dbManager.close()
-		super().fillList(notes)
+		super().fillPages(dbManager.iterAllNotes())
 
 	def updateList(self):
 		self.liststore.clear()
@@ -245,9 +365,7 @@ class NotesListWindow(ListWindow):
 			if result == Gtk.ResponseType.YES:
 				dbManager = DBManager()
 				id_note = model[treeiter][0]
-				dbManager.connect()
 				dbManager.deleteNote(id_note)
-				dbManager.close()
 				self.updateList()
 
 
@@ -284,17 +402,15 @@ class NotesAddWindow(StandardWindow):
 
 		if self.validateFields(title, content):
 			dbManager = DBManager()
-			dbManager.connect()
 			timestamp = datetime.datetime.now()
 			timestamp = timestamp.strftime("%Y-%m-%d %H:%M:%S")
 			id_note = dbManager.saveNote(title, content, timestamp)
-			dbManager.close()
 			UIUtils.showInfoMessage(self.window, "Private note saved", \
 				"Private note succesfully saved")
 			self.titleEntry.set_text("")
 			self.contentEntry.get_buffer().set_text("")
 			self.window.hide()
-			note = [id_note, title, content, timestamp]
+			note = [id_note, title, content[:dbManager.notePreviewSize], timestamp]
 			self.parent.addToList(note)
 
 	def validateFields(self, title, content):
@@ -314,12 +430,14 @@ class NotesEditWindow(StandardWindow):
 		self.contentEntry = builder.get_object("txt_notes_edit_content")
 		self.okButton = builder.get_object("btn_notes_edit_ok")
 		self.cancelButton = builder.get_object("btn_notes_edit_cancel")
+		self.loader = None
 
 		self.window.connect("delete-event", self.onClose)
 		self.okButton.connect("clicked", self.onAccept)
 		self.cancelButton.connect("clicked", self.onCancel)
 
 	def onClose(self, widget, *args):
+		self.stopLoading()
 		self.titleEntry.set_text("")
 		self.contentEntry.get_buffer().set_text("")
 		self.hideWindow()
@@ -329,10 +447,31 @@ class NotesEditWindow(StandardWindow):
 		self.model = model
 		self.treeiter = treeiter
 		self.titleEntry.set_text(model[treeiter][1])
-		self.contentEntry.get_buffer().set_text(model[treeiter][2])
+		self.contentEntry.get_buffer().set_text("")
+		# the body is appended chunk by chunk from the main loop, saving is
+		# only allowed once all of it is in the buffer
+		self.okButton.set_sensitive(False)
+		self.chunks = DBManager().iterNoteContent(model[treeiter][0])
+		self.loader = GLib.idle_add(self.loadNextChunk)
 		super().showWindow()
 
+	def loadNextChunk(self):
+		chunk = next(self.chunks, None)
+		if chunk is None:
+			self.loader = None
+			self.okButton.set_sensitive(True)
+			return False
+		contentBuffer = self.contentEntry.get_buffer()
+		contentBuffer.insert(contentBuffer.get_end_iter(), chunk)
+		return True
+
+	def stopLoading(self):
+		if self.loader is not None:
+			GLib.source_remove(self.loader)
+			self.loader = None
+
 	def onDelete(self, widget, *args):
+		self.stopLoading()
 		self.titleEntry.set_text("")
 		self.contentEntry.get_buffer().set_text("")
 		self.hideWindow()
@@ -346,12 +485,10 @@ class NotesEditWindow(StandardWindow):
 
 		if self.validateFields(title, content):
 			dbManager = DBManager()
-			dbManager.connect()
 			timestamp = datetime.datetime.now()
 			timestamp = timestamp.strftime("%Y-%m-%d %H:%M:%S")
 			id_note = self.model[self.treeiter][0]
 			dbManager.updateNote(id_note, title, content, timestamp)
-			dbManager.close()
 			UIUtils.showInfoMessage(self.window, "Private note updated", \
 				"Private note succesfully updated")
 			self.titleEntry.set_text("")
@@ -367,6 +504,7 @@ class NotesEditWindow(StandardWindow):
 		return True
 
 	def onCancel(self, widget):
+		self.stopLoading()
 		self.titleEntry.set_text("")
 		self.contentEntry.get_buffer().set_text("")
 		self.hideWindow()
@@ -410,10 +548,7 @@ class WebAccountsListWindow(ListWindow):
 
 	def fillList(self):
 		dbManager = DBManager()
-		dbManager.connect()
-		webAccounts = dbManager.getAllWebAccounts()
-		dbManager.close()
-		super().fillList(webAccounts)
+		super().fillPages(dbManager.iterAllWebAccounts())
 
 	def updateList(self):
 		self.liststore.clear()
@@ -440,9 +575,7 @@ class WebAccountsListWindow(ListWindow):
 			if result == Gtk.ResponseType.YES:
 				dbManager = DBManager()
 				id_web = model[treeiter][0]
-				dbManager.connect()
 				dbManager.deleteWebAccount(id_web)
-				dbManager.close()
 				self.updateList()
 
 
@@ -502,9 +635,7 @@ class WebAccountsAddWindow(StandardWindow):
 		website = self.websiteEntry.get_text()
 		if self.validateFields(user, email, password, website):
 			dbManager = DBManager()
-			dbManager.connect()
 			id_web = dbManager.saveWebAccount(user, email, password, website)
-			dbManager.close()
 			UIUtils.showInfoMessage(self.window, "Web account saved", \
 				"Web account succesfully saved")
 			self.userEntry.set_text("")
@@ -591,9 +722,7 @@ class WebAccountsEditWindow(StandardWindow):
 		if self.validateFields(user, email, password, website):
 			id_web = self.model[self.treeiter][0]
 			dbManager = DBManager()
-			dbManager.connect()
 			dbManager.updateWebAccount(id_web, user, email, website, password)
-			dbManager.close()
 			UIUtils.showInfoMessage(self.window, "Web Account updated", \
 				"Web Account succesfully updated")
 			self.userEntry.set_text("")
@@ -793,6 +922,8 @@ class BankAccountsListWindow(ListWindow):
 		self.addWindow = BankAccountsAddWindow(builder, self, genPassWindow, genPinWindow)
 		self.editWindow = BankAccountsEditWindow(builder, self, genPassWindow, genPinWindow)
 		self.cardsListWindow = BankCardsListWindow(builder, self)
+		# cards of every account, loaded together with the list
+		self.cards = {}
 
 		columns = ["ID", "Bank", "Detail", "Username", "Password", "PIN", "Account number", "Alias"]
 		invisible = ["Password", "PIN", "CBU", "Account number"]
@@ -817,10 +948,8 @@ class BankAccountsListWindow(ListWindow):
 
 	def fillList(self):
 		dbManager = DBManager()
-		dbManager.connect()
-		bankAccounts = dbManager.getAllBankAccounts()
-		dbManager.close()
-		super().fillList(bankAccounts)
+		self.cards = dbManager.getAllBankCardsByAccount()
+		super().fillPages(dbManager.iterAllBankAccounts())
 
 	def updateList(self):
 		self.liststore.clear()
@@ -844,9 +973,7 @@ class BankAccountsListWindow(ListWindow):
 			if result == Gtk.ResponseType.YES:
 				dbManager = DBManager()
 				id_bank = model[treeiter][0]
-				dbManager.connect()
 				dbManager.deleteBankAccount(id_bank)
-				dbManager.close()
 				self.updateList()
 
 
@@ -938,9 +1065,7 @@ class BankAccountsAddWindow(StandardWindow):
 
 		if self.validateFields(name):
 			dbManager = DBManager()
-			dbManager.connect()
 			id_bank = dbManager.saveBankAccount(name, detail, user, password, pin, cbu, alias)
-			dbManager.close()
 			UIUtils.showInfoMessage(self.window, "Bank account saved", \
 				"Bank account succesfully saved")
 			self.nameEntry.set_text("")
@@ -1065,9 +1190,7 @@ class BankAccountsEditWindow(StandardWindow):
 		if self.validateFields(name):
 			id_bank = self.model[self.treeiter][0]
 			dbManager = DBManager()
-			dbManager.connect()
 			dbManager.updateBankAccount(id_bank, name, detail, user, password, pin, cbu, alias)
-			dbManager.close()
 			UIUtils.showInfoMessage(self.window, "Bank account saved", \
 				"Bank account succesfully saved")
 			self.nameEntry.set_text("")
@@ -1128,13 +1251,11 @@ class BankCardsListWindow(ListWindow):
 		super().showWindow()
 
 	def fillList(self):
-		dbManager = DBManager()
-		dbManager.connect()
-		bankCards = dbManager.getAllBankCards(self.id_bank)
-		dbManager.close()
-		super().fillList(bankCards)
+		super().fillList(self.parent.cards.get(self.id_bank, []))
 
 	def updateList(self):
+		dbManager = DBManager()
+		self.parent.cards[self.id_bank] = dbManager.getAllBankCards(self.id_bank)
 		self.liststore.clear()
 		self.fillList()
 
@@ -1156,9 +1277,7 @@ class BankCardsListWindow(ListWindow):
 			if result == Gtk.ResponseType.YES:
 				id_card = model[treeiter][0]
 				dbManager = DBManager()
-				dbManager.connect()
 				dbManager.deleteBankCard(id_card)
-				dbManager.close()
 				self.updateList()
 
 
@@ -1243,9 +1362,7 @@ class BankCardsAddWindow(StandardWindow):
 
 		if self.validateFields(number, code):
 			dbManager = DBManager()
-			dbManager.connect()
-			id_card = dbManager.saveBankCard(entity, cardType, number, code, detail, self.id_bank)
-			dbManager.close()
+			dbManager.saveBankCard(entity, cardType, number, code, detail, self.id_bank)
 			UIUtils.showInfoMessage(self.window, "Bank card saved", \
 				"Bank card succesfully saved")
 			self.entityCombo.set_active(0)
@@ -1257,8 +1374,7 @@ class BankCardsAddWindow(StandardWindow):
 			self.codeEntry.set_text("")
 			self.detailEntry.get_buffer().set_text("")
 			self.hideWindow()
-			card = [id_card, entity, cardType, detail, number, code]
-			self.parent.addToList(card)
+			self.parent.updateList()
 
 	def validateFields(self, number, code):
 		if not number or not code:
@@ -1367,9 +1483,7 @@ class BankCardsEditWindow(StandardWindow):
 		if self.validateFields(number, code):
 			id_card = self.model[self.treeiter][0]
 			dbManager = DBManager()
-			dbManager.connect()
 			dbManager.updateBankCard(id_card, entity, cardType, number, code, detail)
-			dbManager.close()
 			UIUtils.showInfoMessage(self.window, "Bank card saved", \
 				"Bank card succesfully saved")
 			self.entityCombo.set_active(0)
@@ -1425,6 +1539,8 @@ class BookListWindow(ListWindow):
 		self.addWindow = BookAddWindow(builder, self)
 		self.editWindow = BookEditWindow(builder, self)
 		self.contactsListWindow = ContactsListWindow(builder, self)
+		# contacts of every book, loaded together with the list
+		self.contacts = {}
 
 		columns = ["ID", "Title", "Detail"]
 		self.initializeTree(columns, None)
@@ -1442,10 +1558,8 @@ class BookListWindow(ListWindow):
 
 	def fillList(self):
 		dbManager = DBManager()
-		dbManager.connect()
-		books = dbManager.getAllBooks()
-		dbManager.close()
-		super().fillList(books)
+		self.contacts = dbManager.getAllContactsByBook()
+		super().fillPages(dbManager.iterAllBooks())
 
 	def updateList(self):
 		self.liststore.clear()
@@ -1469,9 +1583,7 @@ class BookListWindow(ListWindow):
 			if result == Gtk.ResponseType.YES:
 				id_book = model[treeiter][0]
 				dbManager = DBManager()
-				dbManager.connect()
 				dbManager.deleteBook(id_book)
-				dbManager.close()
 				self.updateList()
 
 
@@ -1507,9 +1619,7 @@ class BookAddWindow(StandardWindow):
 		detail = detailBuffer.get_text(start, end, True)
 		if self.validateFields(title):
 			dbManager = DBManager()
-			dbManager.connect()
 			id_book = dbManager.saveBook(title, detail)
-			dbManager.close()
 			UIUtils.showInfoMessage(self.window, "Contact Book saved", \
 				"Contact Book succesfully saved")
 			self.titleEntry.set_text("")
@@ -1557,13 +1667,11 @@ class ContactsListWindow(ListWindow):
 		super().showWindow()
 
 	def fillList(self):
-		dbManager = DBManager()
-		dbManager.connect()
-		bookContacts = dbManager.getAllContacts(self.id_book)
-		dbManager.close()
-		super().fillList(bookContacts)
+		super().fillList(self.parent.contacts.get(self.id_book, []))
 
 	def updateList(self):
+		dbManager = DBManager()
+		self.parent.contacts[self.id_book] = dbManager.getAllContacts(self.id_book)
 		self.liststore.clear()
 		self.fillList()
 
@@ -1585,9 +1693,7 @@ class ContactsListWindow(ListWindow):
 			if result == Gtk.ResponseType.YES:
 				id_contact = model[treeiter][0]
 				dbManager = DBManager()
-				dbManager.connect()
 				dbManager.deleteContact(id_contact)
-				dbManager.close()
 				self.updateList()	
 
 
@@ -1648,9 +1754,7 @@ class ContactsAddWindow(StandardWindow):
 
 		if self.validateFields(name, address,email,phoneOne):
 			dbManager = DBManager()
-			dbManager.connect()
-			id_contact = dbManager.saveContact(name, address, email, phoneOne, phoneTwo, webPage, detail, self.id_book)
-			dbManager.close()
+			dbManager.saveContact(name, address, email, phoneOne, phoneTwo, webPage, detail, self.id_book)
 			UIUtils.showInfoMessage(self.window, "Contact saved", \
 				"Contact succesfully saved")
 			self.nameEntry.set_text("")
@@ -1661,8 +1765,7 @@ class ContactsAddWindow(StandardWindow):
 			self.webPageEntry.set_text("")
 			self.detailEntry.get_buffer().set_text("")
 			self.hideWindow()
-			contact = [id_contact, name, address, email, phoneOne, phoneTwo, webPage, detail]
-			self.parent.addToList(contact)
+			self.parent.updateList()
 
 	def validateFields(self, name, address,email,phoneOne):
 		if not name or not address or not email or not phoneOne:
@@ -1737,9 +1840,7 @@ class ContactsEditWindow(StandardWindow):
 		if self.validateFields(name, address, email, phoneOne):
 			id_contact = self.model[self.treeiter][0]
 			dbManager = DBManager()
-			dbManager.connect()
 			dbManager.updateContact(id_contact, name, address, email, phoneOne, phoneTwo, webPage, detail)
-			dbManager.close()
 			UIUtils.showInfoMessage(self.window, "Contact updated", \
 				"Contact succesfully updated")
 			self.nameEntry.set_text("")
@@ -1800,9 +1901,7 @@ class BookEditWindow(StandardWindow):
 		if self.validateFields(title):
 			id_book = self.model[self.treeiter][0]
 			dbManager = DBManager()
-			dbManager.connect()
 			dbManager.updateBook(id_book, title, detail)
-			dbManager.close()
 			UIUtils.showInfoMessage(self.window, "Contact book updated", \
 				"Contact Book succesfully updated")
 			self.titleEntry.set_text("")
@@ -1836,10 +1935,7 @@ class LogListWindow(ListWindow):
 
 	def fillList(self):
 		dbManager = DBManager()
-		dbManager.connect()
-		logs = dbManager.getAllLogs()
-		dbManager.close()
-		super().fillList(logs)
+		super().fillPages(dbManager.iterAllLogs())
 
 
 class PassphraseWindow:
@@ -1878,7 +1974,12 @@ class PassphraseWindow:
 			return
 		else:
 			dbManager = DBManager()
-			if dbManager.setUser(self.id_user, self.username, passphrase):
+			try:
+				found = dbManager.setUser(self.id_user, self.username, passphrase)
+			except ValueError as e:
+				UIUtils.showErrorMessage(self.window, "Error", str(e))
+				return
+			if found:
 				self.parent.successfulLogin()
 				self.txtPass.set_text("")
 				self.window.hide()
@@ -1887,6 +1988,66 @@ class PassphraseWindow:
 					"Wrong passphrase submitted, please retry")
 
 
+class ChangePassphraseWindow(StandardWindow):
+	def __init__(self, builder, parent):
+		window = builder.get_object("window_change_passphrase")
+		super().__init__(window, parent)
+
+		self.okButton = builder.get_object("btn_change_passphrase_ok")
+		self.cancelButton = builder.get_object("btn_change_passphrase_cancel")
+		self.txtCurrent = builder.get_object("txt_change_passphrase_current")
+		self.txtPassOne = builder.get_object("txt_change_passphrase_new_one")
+		self.txtPassTwo = builder.get_object("txt_change_passphrase_new_two")
+
+		self.window.connect("delete-event", self.onClose)
+		self.cancelButton.connect("clicked", self.onCancel)
+		self.okButton.connect("clicked", self.onAccept)
+
+	def clearFields(self):
+		self.txtCurrent.set_text("")
+		self.txtPassOne.set_text("")
+		self.txtPassTwo.set_text("")
+
+	def onClose(self, widget, *args):
+		self.clearFields()
+		super().hideWindow()
+		return True
+
+	def onCancel(self, button):
+		self.clearFields()
+		super().hideWindow()
+
+	def onAccept(self, button):
+		current = self.txtCurrent.get_text()
+		passone = self.txtPassOne.get_text()
+		passtwo = self.txtPassTwo.get_text()
+
+		if self.validateFields(current, passone, passtwo):
+			dbManager = DBManager()
+			changed = dbManager.changePassphrase(current, passone)
+			if not changed:
+				UIUtils.showErrorMessage(self.window, "Error", \
+					"Wrong current passphrase submitted, please retry")
+				return
+			UIUtils.showInfoMessage(self.window, "Passphrase changed", \
+				"Passphrase succesfully changed")
+			self.clearFields()
+			super().hideWindow()
+
+	def validateFields(self, current, pwd_one, pwd_two):
+		if not current or not pwd_one or not pwd_two:
+			UIUtils.showErrorMessage(self.window, "Error", "All fields required")
+			return False
+		if pwd_one != pwd_two:
+			UIUtils.showErrorMessage(self.window, "Error", "Both passphrases do not match")
+			return False
+		if len(pwd_one) < 8:
+			UIUtils.showErrorMessage(self.window, "Error", \
+				"Passphrase must have at least 8 characters")
+			return False
+		return True
+
+
 class RegisterWindow:
 	def __init__(self, builder, parent):
 		self.parent = parent
@@ -1947,7 +2108,6 @@ class RegisterWindow:
 
 		if self.validateFields(username, passone, passtwo, self.imageState, self.window):
 			dbManager = DBManager()
-			dbManager.connect()
 			dbManager.registerUser(username, passone, self.imageEncoding)
 			UIUtils.showInfoMessage(self.window, "User registered", \
 				"User succesfully registered")
@@ -1960,7 +2120,6 @@ class RegisterWindow:
 			self.window.hide()
 			self.parent.showWindow()
 				
-			dbManager.close()
 
 	
 	def validateFields(self, usr, pwd_one, pwd_two, state, parent):
@@ -2002,114 +2161,3 @@ class UIUtils(object):
 		response = dialog.run()
 		dialog.destroy()
 		return response
-
-# ======== Face Recognition ========
-
-class FaceRecognizer:
-	def getEncoding(self):
-		video_capture = cv2.VideoCapture(0)
-		face_locations = []
-		face_encodings = []
-		face_names = []
-		process_this_frame = True
-		cur_encoding = None
-
-		while True:
-			ret, frame = video_capture.read()
-			small_frame = cv2.resize(frame, (0,0), fx=0.25, fy=0.25)
-			rgb_small_frame = small_frame[:,:,::-1]
-
-			font = cv2.FONT_HERSHEY_DUPLEX
-
-			if process_this_frame:
-				face_locations = face_recognition.face_locations(rgb_small_frame)
-				face_encodings = face_recognition.face_encodings(rgb_small_frame, face_locations)
-				name = "Press \"W\""
-				face_names.append(name)
-				for face_encoding in face_encodings:
-					cur_encoding = face_encoding
-
-			process_this_frame = not process_this_frame
-
-			for (top, right, bottom, left), name in zip(face_locations, face_names):
-				top *= 4
-				right *= 4
-				bottom *= 4
-				left *= 4
-
-				cv2.rectangle(frame, (left, top), (right, bottom), (0, 0, 255), 2)
-				cv2.rectangle(frame, (left, bottom - 35), (right, bottom), (0, 0, 255), cv2.FILLED)
-				cv2.putText(frame, name, (left + 6, bottom - 6), font, 1.0, (255, 255, 255), 1)
-
-			cv2.putText(frame, "Press \"q\" to quit", (10,30), font, 0.8, (0,255,0), 1)
-			cv2.imshow('Face capture', frame)
-			if cv2.waitKey(33) == ord('q'):
-			    break
-			elif cv2.waitKey(33) == ord('w'):
-				video_capture.release()
-				cv2.destroyAllWindows()
-				return cur_encoding
-
-		video_capture.release()
-		cv2.destroyAllWindows()
-		return None
-
-	def recognizeUser(self):
-		video_capture = cv2.VideoCapture(0)
-
-		dbManager = DBManager()
-		dbManager.connect()
-		known_ids, known_face_names, known_face_encodings = dbManager.getKnownUsers()
-		dbManager.close()
-
-		face_locations = []
-		face_encodings = []
-		face_names = []
-		process_this_frame = True
-
-		while True:
-			ret, frame = video_capture.read()
-			small_frame = cv2.resize(frame, (0,0), fx=0.25, fy=0.25)
-			rgb_small_frame = small_frame[:,:,::-1]
-
-			font = cv2.FONT_HERSHEY_DUPLEX
-
-			if process_this_frame:
-				face_locations = face_recognition.face_locations(rgb_small_frame)
-				face_encodings = face_recognition.face_encodings(rgb_small_frame, face_locations)
-				face_names = []
-				for face_encoding in face_encodings:
-					name = "Unknown"
-					if(len(known_face_names) > 0):
-						matches = face_recognition.compare_faces(known_face_encodings, face_encoding)
-						face_distances = face_recognition.face_distance(known_face_encodings, face_encoding)
-						best_match_index = np.argmin(face_distances)
-						if matches[best_match_index]:
-							name = known_face_names[best_match_index]
-							id_user = known_ids[best_match_index]
-							video_capture.release()
-							cv2.destroyAllWindows()
-							return id_user, name
-
-					face_names.append(name)
-
-			process_this_frame = not process_this_frame
-
-			for (top, right, bottom, left), name in zip(face_locations, face_names):
-				top *= 4
-				right *= 4
-				bottom *= 4
-				left *= 4
-
-				cv2.rectangle(frame, (left, top), (right, bottom), (0, 0, 255), 2)
-				cv2.rectangle(frame, (left, bottom - 35), (right, bottom), (0, 0, 255), cv2.FILLED)
-				cv2.putText(frame, name, (left + 6, bottom - 6), font, 1.0, (255, 255, 255), 1)
-
-			cv2.putText(frame, "Press \"q\" to quit", (10,30), font, 0.8, (0,255,0), 1)
-			cv2.imshow('Facial login', frame)
-			if cv2.waitKey(1) & 0xFF == ord('q'):
-			    break
-
-		video_capture.release()
-		cv2.destroyAllWindows()
-		return None, None
\ No newline at end of file